@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CommandResult:
+    command: list | str
+    returncode: int | None = None
+    stdout: str = ""
+    stderr: str = ""
+    duration: float = 0.0 # seconds, measured from the process start (not from the time it was queued)
+    timed_out: bool = False
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+
+async def run_command_async(command, timeout=None, shell=False, semaphore=None):
+    """
+    Execute a command with asyncio and return a CommandResult.
+    If the command does not complete in timeout seconds it is killed and the result is marked as timed_out.
+    If the task is cancelled the process is killed before propagating the cancellation, so no result is returned.
+        semaphore: optional asyncio.Semaphore used to limit the number of concurrent processes
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+    result = CommandResult(command=command)
+    async with semaphore:
+        start_time = time.perf_counter()
+        try:
+            if shell:
+                proc = await asyncio.create_subprocess_shell(command if isinstance(command, str) else " ".join(command),
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            else:
+                proc = await asyncio.create_subprocess_exec(*[str(c) for c in command],
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            # e.g. executable not found: report it in the result rather than aborting the whole batch
+            result.stderr = str(e)
+            return result
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+            result.stdout = out.decode("utf-8", errors="replace")
+            result.stderr = err.decode("utf-8", errors="replace")
+        except asyncio.TimeoutError:
+            result.timed_out = True
+            await _kill(proc)
+        except asyncio.CancelledError:
+            await _kill(proc)
+            raise
+        finally:
+            result.duration = time.perf_counter() - start_time
+        result.returncode = proc.returncode
+    return result
+
+
+async def run_commands_async(commands, max_concurrency=None, timeout=None, shell=False):
+    """
+    Execute all the commands with at most max_concurrency processes at the same time (default: number of cpus).
+    Return the list of CommandResult in the same order as commands.
+        timeout: timeout in seconds of each single command
+    """
+    if max_concurrency is None:
+        max_concurrency = os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = [asyncio.create_task(run_command_async(c, timeout=timeout, shell=shell, semaphore=semaphore)) for c in commands]
+    try:
+        return await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        # make sure all the children are cancelled and wait for them to kill their processes
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run_commands(commands, max_concurrency=None, timeout=None, shell=False):
+    """
+    Synchronous wrapper of run_commands_async, to be used from non-async code.
+    On KeyboardInterrupt all the running processes are killed.
+    """
+    return asyncio.run(run_commands_async(commands, max_concurrency=max_concurrency, timeout=timeout, shell=shell))
+
+
+async def _kill(proc):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
@@ -1,10 +1,23 @@
 from openscripts.global_utils import is_linux, is_windows
 from .process_utils import execute_command
+import functools
+import json
+import os
+import re
+import subprocess
+import threading
+import time
 import psutil
 
 if is_windows():
     import win32api
 
+# default seconds after which a drive that does not respond (e.g. a stale network share) is considered unavailable
+PROBE_TIMEOUT = 5.0
+# seconds for which the labels of the drives are reused without querying the system again
+LABELS_CACHE_TTL = 30
+_labels_cache = {"time": 0.0, "labels": None}
+
 def list_drive_paths(list_all=True):
     # if is_windows():
     #     drives = win32api.GetLogicalDriveStrings()
@@ -21,16 +34,156 @@ def get_name_by_drive_path(path):
         except Exception:
             return ""
     elif is_linux():
-        res = execute_command(["lsblk", "-o", "label,mountpoint"], silent=True, return_output=True, shell=False)
-        res = res[1:] # skip first line with legend
-        res_nonempty = [r for r in res if r.strip("\n").strip()] # remove empty lines, sort of
-        res_labeled = [r.strip("\n") for r in res_nonempty if r[0] != " "] # keep only where a label is present
-        # assume labels have no space or I don't know how it behaves (does it add quotes?)
-        res_labeled = [r.split(" ") for r in res_labeled]
-        for r in res_labeled:
-            if r[1] == path:
-                return r[0]
-        return ""
+        return get_labels_by_drive_path().get(path, "")
+
+def get_labels_by_drive_path(refresh=False, ttl=LABELS_CACHE_TTL):
+    """
+    Return a dict mountpoint -> label of all the mounted drives that have a label.
+    All the labels are resolved at once and cached for ttl seconds, use refresh to force a new query.
+    """
+    now = time.monotonic()
+    if not refresh and _labels_cache["labels"] is not None and now - _labels_cache["time"] < ttl:
+        return _labels_cache["labels"]
+    if is_windows():
+        labels = {}
+        for path in list_drive_paths():
+            try:
+                label = win32api.GetVolumeInformation(path)[0]
+            except Exception:
+                label = ""
+            if label:
+                labels[path] = label
+    elif is_linux():
+        labels = _get_labels_from_dev()
+        if labels is None:
+            labels = _get_labels_from_lsblk()
+    else:
+        labels = {}
+    _labels_cache["time"] = now
+    _labels_cache["labels"] = labels
+    return labels
+
+def _unescape_mount_field(field):
+    # /proc/self/mountinfo escapes spaces, tabs, newlines and backslashes as octal (e.g. \040)
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+def _get_labels_from_dev():
+    # resolve labels without spawning any process, from /dev/disk/by-label and /proc/self/mountinfo
+    # return None if the information is not available (e.g. in some containers)
+    by_label = "/dev/disk/by-label"
+    if not os.path.isdir(by_label) or not os.path.isfile("/proc/self/mountinfo"):
+        return None
+    device_labels = {}
+    for entry in os.scandir(by_label):
+        # in the name of the links, special characters are escaped as \xNN (e.g. \x20 for spaces)
+        label = re.sub(r"\\x([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), entry.name)
+        device_labels[os.path.realpath(entry.path)] = label
+    labels = {}
+    with open("/proc/self/mountinfo", "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            fields = line.split()
+            separator = fields.index("-")
+            mountpoint = _unescape_mount_field(fields[4])
+            source = fields[separator + 2]
+            if source.startswith("/dev/"):
+                source = os.path.realpath(source)
+            if source in device_labels:
+                labels[mountpoint] = device_labels[source]
+    return labels
+
+def _get_labels_from_lsblk():
+    # json output handles labels with spaces, mountpoints is available only in recent versions of lsblk
+    for column in ["mountpoints", "mountpoint"]:
+        try:
+            res = execute_command(["lsblk", "--json", "--list", "-o", f"label,{column}"], silent=True, return_output=True, shell=False)
+        except (subprocess.CalledProcessError, OSError):
+            continue
+        labels = {}
+        for dev in json.loads(res).get("blockdevices", []):
+            mountpoints = dev.get(column)
+            if not isinstance(mountpoints, list):
+                mountpoints = [mountpoints]
+            if dev.get("label"):
+                for m in mountpoints:
+                    if m:
+                        labels[m] = dev["label"]
+        return labels
+    return {}
+
+def get_device_by_path(path):
+    """
+    Return an identifier of the physical device that contains path, e.g. "sda" on linux, so that partitions of the same disk have the same identifier.
+    If path does not exist the closest existing parent is used. On windows the volume is returned.
+    Return None if path and its parents cannot be accessed.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    try:
+        st_dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    if is_windows():
+        return os.path.splitdrive(path)[0].upper()
+    if is_linux():
+        disk = _get_linux_disk(os.major(st_dev), os.minor(st_dev))
+        if disk is not None:
+            return disk
+    return str(st_dev)
+
+@functools.lru_cache(maxsize=None)
+def _get_linux_disk(major, minor):
+    # /sys/dev/block/<major>:<minor> links to the partition folder, which is inside the folder of its disk
+    # not available for filesystems without a block device, e.g. network shares or tmpfs
+    sys_path = f"/sys/dev/block/{major}:{minor}"
+    if not os.path.exists(sys_path):
+        return None
+    real_path = os.path.realpath(sys_path)
+    if os.path.isfile(os.path.join(real_path, "partition")):
+        real_path = os.path.dirname(real_path)
+    return os.path.basename(real_path)
+
+def list_drives(list_all=True, timeout=PROBE_TIMEOUT):
+    """
+    Return a tuple (drives, unavailable) where drives is the list of (path, label) of the responsive drives
+    and unavailable the list of paths of the drives that did not respond within timeout seconds or raised an error.
+    All drives are probed concurrently, so the total time is bounded by timeout regardless of the number of drives.
+    """
+    paths = list_drive_paths(list_all=list_all)
+    if is_linux():
+        # labels are resolved all at once without touching the drives
+        labels = get_labels_by_drive_path()
+        get_label = lambda p: labels.get(p, "")
+    else:
+        get_label = get_name_by_drive_path
+    results = {}
+
+    def probe(path):
+        try:
+            os.stat(path) # hangs on stale network shares
+            results[path] = get_label(path)
+        except OSError:
+            results[path] = None
+
+    # daemon threads: a thread blocked on a dead mount must not prevent the program from exiting
+    threads = [threading.Thread(target=probe, args=(p,), daemon=True) for p in paths]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    drives = []
+    unavailable = []
+    for p in paths:
+        label = results.get(p)
+        if label is None:
+            unavailable.append(p)
+        else:
+            drives.append((p, label))
+    return drives, unavailable
 
 if __name__ == "__main__":
     d = list_drive_paths()
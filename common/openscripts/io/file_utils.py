@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
 
 
 def human_readable(num, suffix="B", divider=1024.0):
@@ -10,3 +14,43 @@ def human_readable(num, suffix="B", divider=1024.0):
             return f"{num:3.2f} {unit}{suffix}"
         num /= divider
     return f"{num:.2f} Y{suffix}"
+
+def is_same_filesystem(path_a, path_b):
+    return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+
+def make_temp_file(folder, prefix=".tmp_", suffix=""):
+    """
+    Create an empty file with a unique name in folder and return its path.
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=prefix, suffix=suffix)
+    os.close(fd)
+    return Path(tmp_path)
+
+def atomic_replace(src, dst, chunk_size=16*1024*1024):
+    """
+    Replace dst with src atomically, i.e. dst is always either the old or the new file, never a partial one.
+    If src is on a different filesystem, it is first copied (streamed in chunks) to a temporary file in the folder of dst, 
+    which then replaces dst. src is removed in both cases.
+    The permissions of dst, if it exists, are kept (temp files are usually created readable only by the owner).
+    """
+    src = Path(src)
+    dst = Path(dst)
+    if is_same_filesystem(src, dst.parent):
+        if dst.exists():
+            shutil.copymode(dst, src)
+        os.replace(src, dst)
+        return
+    tmp_path = make_temp_file(dst.parent, prefix=f".{dst.stem}_", suffix=dst.suffix)
+    try:
+        with open(src, "rb") as fin, open(tmp_path, "wb") as fout:
+            shutil.copyfileobj(fin, fout, length=chunk_size)
+            fout.flush()
+            os.fsync(fout.fileno())
+        if dst.exists():
+            shutil.copymode(dst, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    src.unlink()
@@ -0,0 +1,84 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+
+class ProbeCache:
+    """
+    Persistent cache (sqlite) of the data obtained by probing or reading files (e.g. mkvmerge -J, hashes of audio files).
+    Entries are keyed by path and kind of probe and are valid only as long as size, mtime and inode of the file do not change.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(self.db_path)
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (path, kind))"
+        )
+        self._con.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._con.commit()
+        self._con.close()
+
+    @staticmethod
+    def _identity(file_path):
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, file_path, kind):
+        """
+        Return the cached data for the file, or None if missing or if the file changed since it was stored.
+        """
+        key = str(Path(file_path).resolve())
+        row = self._con.execute("SELECT size, mtime_ns, inode, data FROM probes WHERE path = ? AND kind = ?", (key, kind)).fetchone()
+        if row is None:
+            return None
+        try:
+            identity = self._identity(key)
+        except OSError:
+            identity = None
+        if identity != tuple(row[:3]):
+            # stale entry
+            self._con.execute("DELETE FROM probes WHERE path = ? AND kind = ?", (key, kind))
+            return None
+        return json.loads(row[3])
+
+    def set(self, file_path, kind, data):
+        key = str(Path(file_path).resolve())
+        size, mtime_ns, inode = self._identity(key)
+        self._con.execute(
+            "INSERT OR REPLACE INTO probes (path, kind, size, mtime_ns, inode, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, size, mtime_ns, inode, json.dumps(data))
+        )
+
+    def invalidate(self, file_path):
+        key = str(Path(file_path).resolve())
+        self._con.execute("DELETE FROM probes WHERE path = ?", (key,))
+
+    def prune(self):
+        """
+        Remove all the entries of files that no longer exist or that changed.
+        Return the number of removed entries.
+        """
+        to_remove = []
+        for path, kind, size, mtime_ns, inode in self._con.execute("SELECT path, kind, size, mtime_ns, inode FROM probes").fetchall():
+            try:
+                identity = self._identity(path)
+            except OSError:
+                identity = None
+            if identity != (size, mtime_ns, inode):
+                to_remove.append((path, kind))
+        self._con.executemany("DELETE FROM probes WHERE path = ? AND kind = ?", to_remove)
+        self._con.commit()
+        return len(to_remove)
@@ -1,23 +1,66 @@
 import subprocess
+from collections import deque
 
 
-def execute_command(command_with_args, silent=False, return_output=False, shell=True):
+def execute_command(command_with_args, silent=False, return_output=False, shell=True, stream=False, tail_lines=None):
+    """
+    Execute a command and optionally return its output.
+        stream: print the output line by line while the process is running, rather than when it exits,
+            the lines are kept in memory only if return_output is set.
+            Note that in this mode stderr is merged into stdout, so silent hides also stderr (always printed in the buffered mode).
+        tail_lines: if set, keep only the last tail_lines lines of output in memory and return only those.
+            The output is read line by line as in stream mode (also with stream=False), so stderr is merged into stdout.
+    """
+    if stream or tail_lines is not None:
+        output_lines = deque(maxlen=tail_lines)
+        for line in stream_command(command_with_args, shell=shell):
+            if return_output:
+                output_lines.append(line)
+            if not silent:
+                print(line, end='', flush=True)
+        if return_output:
+            return "".join(output_lines)
+        return
+
     output_lines = []
-    with subprocess.Popen(command_with_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+    with subprocess.Popen(command_with_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
             universal_newlines=True, shell=shell, bufsize=1, encoding="utf-8") as proc:
         (out, err) = proc.communicate() # use communicate or we may get a deadlock
         if out is not None:
-            for line in out:
+            for line in out.splitlines(keepends=True):
                 output_lines.append(line)
                 if not silent:
                     print(line, end='')
         if err is not None:
-            for line in err:
+            for line in err.splitlines(keepends=True):
                 output_lines.append(line)
                 print(line, end='')
 
     if proc.returncode != 0:
         raise subprocess.CalledProcessError(proc.returncode, proc.args)
-    
+
     if return_output:
         return "".join(output_lines)
+
+
+def stream_command(command_with_args, shell=True):
+    """
+    Execute a command and yield its output line by line as soon as it is available.
+    Stderr is merged into stdout, so that only one pipe is read and there is no risk of deadlock.
+    Raise CalledProcessError when the process exits with a non-zero code.
+    If the generator is closed before the end, the process is killed.
+    """
+    with subprocess.Popen(command_with_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, shell=shell, bufsize=1, encoding="utf-8", errors="replace") as proc:
+        completed = False
+        try:
+            for line in proc.stdout:
+                yield line
+            completed = True
+        finally:
+            if not completed and proc.poll() is None:
+                # early exit from the consumer (or exception): do not leave the process running
+                proc.kill()
+
+    if completed and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
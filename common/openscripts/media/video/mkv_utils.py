@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 
 
 def get_tracks_by_type(json_data: dict, track_type: str) -> list:
@@ -55,3 +56,97 @@ def get_tracks_to_keep_by_lang(tracks: list, languages_blacklist: list | None =
 
 
 
+
+
+@dataclass(slots=True)
+class Track:
+    """
+    Track as returned by mkvmerge -J, with the most used properties already extracted.
+    """
+    id: int
+    type: str
+    uid: int | None = None
+    language: str | None = None
+    language_ietf: str | None = None
+    default_track: bool = False
+    forced_track: bool = False
+    properties: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, track: dict) -> "Track":
+        properties = track.get("properties", {})
+        return cls(
+            id=track["id"],
+            type=track["type"],
+            uid=properties.get("uid", None),
+            language=properties.get("language", None),
+            language_ietf=properties.get("language_ietf", None),
+            default_track=properties.get("default_track", False),
+            forced_track=properties.get("forced_track", False),
+            properties=properties,
+        )
+
+    @property
+    def effective_language(self) -> str | None:
+        # the legacy language has the precedence, as in get_tracks_to_keep_by_lang
+        return self.language if self.language is not None else self.language_ietf
+
+    def has_language(self, lang: str) -> bool:
+        return self.language == lang or self.language_ietf == lang
+
+
+@dataclass(slots=True)
+class MkvFile:
+    """
+    Parsed output of mkvmerge -J, with the tracks indexed by type and by language.
+    """
+    tracks: tuple[Track, ...]
+    raw: dict = field(repr=False)
+    _by_type: dict = field(init=False, repr=False)
+    _by_lang: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._by_type = {}
+        self._by_lang = {}
+        for tr in self.tracks:
+            self._by_type.setdefault(tr.type, []).append(tr)
+            self._by_lang.setdefault((tr.type, tr.effective_language), []).append(tr)
+
+    @classmethod
+    def from_json(cls, json_data: dict) -> "MkvFile":
+        return cls(tracks=tuple(Track.from_json(tr) for tr in json_data["tracks"]), raw=json_data)
+
+    def tracks_by_type(self, track_type: str) -> list[Track]:
+        return self._by_type.get(track_type, [])
+
+    @property
+    def audio_tracks(self) -> list[Track]:
+        return self.tracks_by_type("audio")
+
+    @property
+    def subtitle_tracks(self) -> list[Track]:
+        return self.tracks_by_type("subtitles")
+
+    def tracks_by_language(self, track_type: str, lang: str | None) -> list[Track]:
+        """
+        Return the tracks of the given type with the given language (legacy language or, if missing, IETF).
+        """
+        return self._by_lang.get((track_type, lang), [])
+
+    def languages(self, track_type: str) -> set[str | None]:
+        return {lang for (t, lang) in self._by_lang if t == track_type}
+
+
+def filter_tracks_by_lang(tracks: list[Track], languages_blacklist=None, languages_whitelist=None, allow_none: bool = False) -> list[Track]:
+    """
+    Same as get_tracks_to_keep_by_lang, but for Track objects.
+    Only one between whitelist and blacklist must be specified.
+    """
+    assert (languages_blacklist and not languages_whitelist) or (languages_whitelist and not languages_blacklist), "Exactly one between language blacklist and whitelist must be defined"
+    if languages_whitelist:
+        whitelist = frozenset(languages_whitelist)
+        is_good = whitelist.__contains__
+    else:
+        blacklist = frozenset(languages_blacklist)
+        is_good = lambda lang: lang not in blacklist
+    return [tr for tr in tracks if (allow_none if tr.effective_language is None else is_good(tr.effective_language))]
@@ -0,0 +1,142 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+
+def tree_fingerprint(root):
+    """
+    Fingerprint of a folder tree built from the relative path, size and modification time of all the files and folders.
+    It changes when any file is added, removed, renamed or modified, without reading the content of the files.
+    Return None if the folder does not exist.
+    """
+    if not os.path.isdir(root):
+        return None
+    digest = hashlib.sha1()
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError:
+            # unreadable folder: make sure the fingerprint is different from the readable case
+            digest.update(f"!{os.path.relpath(folder, root)}\n".encode("utf-8", errors="surrogateescape"))
+            continue
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, root)
+            if entry.is_dir(follow_symlinks=False):
+                digest.update(f"d {rel_path}\n".encode("utf-8", errors="surrogateescape"))
+                stack.append(entry.path)
+            else:
+                st = entry.stat(follow_symlinks=False)
+                digest.update(f"f {rel_path} {st.st_size} {st.st_mtime_ns}\n".encode("utf-8", errors="surrogateescape"))
+    return digest.hexdigest()
+
+
+def folder_identity(path):
+    """
+    Cheap identity of a folder and of its filesystem: device and inode of the folder (on windows the volume serial number and
+    the file index) and, where available, the filesystem id (derived from the uuid on most linux filesystems).
+    It changes when the folder is recreated or when it is on a different disk, also if label and mount point are the same.
+    Return None if the folder does not exist.
+    """
+    try:
+        st = os.stat(path)
+        identity = f"{st.st_dev}:{st.st_ino}"
+        if hasattr(os, "statvfs"):
+            identity += f":{os.statvfs(path).f_fsid}"
+    except OSError:
+        return None
+    return identity
+
+
+class ChangeDetector:
+    """
+    Manifest of the fingerprint of the source at the time of the last successful sync of each (folder id, source, destination).
+    Used to skip the syncs whose source did not change since then.
+    The identity of the local destinations (see folder_identity) is saved too, so that a replaced or reformatted disk is synced again.
+    Note that changes made directly to the destination are not detected.
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.manifest = {}
+        self._fingerprints = {} # cache of the fingerprints computed in this run, by path (futures, set when the walk ends)
+        self._lock = threading.Lock()
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r', encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def _key(fold_id, dr_a, dr_b):
+        return f"{fold_id}|{dr_a.path}|{dr_b.path}"
+
+    @staticmethod
+    def _settings_hash(mode, args):
+        # a change of the mode or of the arguments (e.g. filters) must trigger a new sync
+        return hashlib.sha1(json.dumps([mode, list(args)]).encode("utf-8")).hexdigest()
+
+    def fingerprint(self, dr):
+        # remotes are not supported, they are always synced
+        if dr.is_remote:
+            return None
+        # the walk runs outside the lock, so independent sources are walked in parallel and the other methods are not blocked,
+        # the threads that need a source already being walked wait for the same future
+        with self._lock:
+            future = self._fingerprints.get(dr.path)
+            owner = future is None
+            if owner:
+                future = self._fingerprints[dr.path] = Future()
+        if owner:
+            try:
+                future.set_result(tree_fingerprint(dr.path))
+            except Exception as e:
+                # do not cache the error, the next call walks again
+                with self._lock:
+                    if self._fingerprints.get(dr.path) is future:
+                        del self._fingerprints[dr.path]
+                future.set_exception(e)
+        return future.result()
+
+    def invalidate(self, dr):
+        # to be called when a drive is modified (e.g. it was the destination of a sync)
+        with self._lock:
+            self._fingerprints.pop(dr.path, None)
+
+    def is_unchanged(self, fold_id, dr_a, dr_b, mode, args):
+        """
+        Return (unchanged, fingerprint) where unchanged is true if the source has the same fingerprint as in the last successful sync,
+        to the same destination folder.
+        """
+        fingerprint = self.fingerprint(dr_a)
+        if fingerprint is None:
+            return False, None
+        entry = self.manifest.get(self._key(fold_id, dr_a, dr_b))
+        unchanged = (entry is not None and entry["fingerprint"] == fingerprint and entry["settings"] == self._settings_hash(mode, args)
+            and entry.get("destination") == self._destination_identity(dr_b))
+        return unchanged, fingerprint
+
+    @staticmethod
+    def _destination_identity(dr):
+        # remotes have no cheap identity
+        return None if dr.is_remote else folder_identity(dr.path)
+
+    def mark_synced(self, fold_id, dr_a, dr_b, mode, args, fingerprint):
+        if fingerprint is None:
+            return
+        # read after the sync, which may have created the destination folder
+        destination = self._destination_identity(dr_b)
+        with self._lock:
+            self.manifest[self._key(fold_id, dr_a, dr_b)] = {
+                "fingerprint": fingerprint,
+                "settings": self._settings_hash(mode, args),
+                "destination": destination,
+                "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+
+    def save(self):
+        with self._lock:
+            with open(self.manifest_file, 'w', encoding="utf-8") as f:
+                json.dump(self.manifest, f, indent=4)
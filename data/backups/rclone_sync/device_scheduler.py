@@ -0,0 +1,47 @@
+import threading
+from contextlib import contextmanager
+
+from openscripts.io import drive_utils
+
+
+class DeviceScheduler:
+    """
+    Limit the number of syncs that use the same physical device (local disk or remote) at the same time.
+    A sync waits until both its source and its destination devices have a free slot and takes them together,
+    so syncs on independent devices run at the same time while the ones sharing a disk do not thrash it.
+    """
+
+    def __init__(self, max_jobs_per_device=1):
+        self.max_jobs_per_device = max_jobs_per_device
+        self._devices = {} # drive letter -> device
+        self._running = {} # device -> number of running syncs
+        self._devices_lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def device(self, dr):
+        # device of a DriveObject: each remote is a device, local drives are resolved to their disk
+        if dr.is_remote:
+            return f"remote:{dr.drive_letter}"
+        with self._devices_lock:
+            if dr.drive_letter not in self._devices:
+                # drives on which the device cannot be resolved are considered independent
+                self._devices[dr.drive_letter] = drive_utils.get_device_by_path(dr.drive_letter) or f"drive:{dr.drive_name}"
+            return self._devices[dr.drive_letter]
+
+    @contextmanager
+    def slot(self, *drives):
+        """
+        Context manager that blocks until all the devices of the given DriveObjects have a free slot.
+        """
+        devices = {self.device(dr) for dr in drives}
+        with self._condition:
+            self._condition.wait_for(lambda: all(self._running.get(d, 0) < self.max_jobs_per_device for d in devices))
+            for d in devices:
+                self._running[d] = self._running.get(d, 0) + 1
+        try:
+            yield devices
+        finally:
+            with self._condition:
+                for d in devices:
+                    self._running[d] -= 1
+                self._condition.notify_all()
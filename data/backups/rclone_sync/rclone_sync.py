@@ -1,17 +1,30 @@
 import yaml
 import os
 import argparse
-import re
+import sys
 import datetime 
+import threading
+import time
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # load local libs
 from openscripts.io import drive_utils
 from openscripts.io import process_utils
-from DriveObject import DriveObject
+from sync_log import LogWriter, EventLog, parse_rclone_json_line
+from change_detection import ChangeDetector
+from device_scheduler import DeviceScheduler
+from sync_plan import SyncPlan, compile_settings, compile_folders, format_plan
 
-DATE_TIME_REGEX = "\$datetime{(.*?)}"
-global OUTPUT_FILE # path to the log file
+global OUTPUT_FILE # LogWriter of the log file
 OUTPUT_FILE = None
+global EVENT_LOG # EventLog with one json line for the start and the end of each sync job
+EVENT_LOG = None
+global CHANGE_DETECTOR # ChangeDetector used to skip the syncs of unchanged sources, None if disabled
+CHANGE_DETECTOR = None
+FAILED_JOBS = [] # (fold_id, source, destination, error) of the failed syncs
+PRINT_LOCK = threading.Lock() # syncs may run in parallel threads
 
 def load_config(config_path):
     # load yaml configuration
@@ -19,44 +32,31 @@ def load_config(config_path):
         conf = yaml.safe_load(ff)
     return conf
 
-def load_key_or_default(dict, key, default="", ignore_empty=False):
-    # given a dictionary, check if a key exists, if it exists return it, otherwise return the 'default' param
-    # if ignore_empty is true return the default parameter also if the key is present but is an empty string or list
-    if key in dict.keys():
-        val = dict[key]
-        # return default if it is not a number or bool (bool is a subclass of int) and is either an empty string or an empty list
-        if ignore_empty and not isinstance(val, (int, float)) and (len(dict[key])==0):
-            return default
-        return dict[key]
-    else:
-        return default
-
-def empty_list_on_empty_string(s, split_on=" "):
-    # split a string on a given subset of characters
-    # if the string is empty return an empty list
-    return s.split(split_on) if s.strip() != "" else []
-
 def print_and_log(my_string, skip_stdout=False):
     # print a string to stdout and write it to the global OUTPUT_FILE
     # if skip_stdout is true, only write to OUTPUT_FILE
-    if not skip_stdout: 
-        print(my_string)
-    if OUTPUT_FILE is not None:
-        with open(OUTPUT_FILE, 'a', encoding="utf-8") as of:
-                of.write(f"\n{my_string}")
+    with PRINT_LOCK:
+        if not skip_stdout: 
+            print(my_string, flush=True)
+        if OUTPUT_FILE is not None:
+            OUTPUT_FILE.write(my_string)
 
 def main():
-    global OUTPUT_FILE
+    global OUTPUT_FILE, EVENT_LOG, CHANGE_DETECTOR
     print()
     current_datetime = datetime.datetime.now()
     # load config
     parser = argparse.ArgumentParser(description='Sync utility')
     parser.add_argument('--config', '-cfg', help='Path to the script configuration file', type=str)
     parser.add_argument('--rclone_path', '-rp', help='Path to rclone executable if not in PATH', type=str)
+    parser.add_argument('--batch', '-b', help='Non-interactive mode (e.g. for cron), never ask for input', action='store_true')
+    parser.add_argument('--plan', '-p', help='Validate the configuration, print the sync plan and exit without syncing', action='store_true')
     args = parser.parse_args()
 
     if args.config:
         config_path = args.config
+    elif args.batch:
+        parser.error("--config is required in batch mode")
     else:
         config_path = input("Enter the path to the script configuration file:\n")
         print()
@@ -66,105 +66,280 @@ def main():
     if args.rclone_path:
         rclone_exe = os.path.join(args.rclone_path, rclone_exe)
 
-    # get sync mode
-    sync_mode = config_dic['config']['sync_mode']
-    assert sync_mode in ['copy', 'sync'], "Invalid sync mode"
-    # get list all drives option
-    extended_list_drives = load_key_or_default(config_dic['config'], 'extended_drive_search', default=False, ignore_empty=True)
-    # get rclone global args
-    rclone_global_args = load_key_or_default(config_dic['config'], 'arguments', default="", ignore_empty=False)
-    rclone_global_args = empty_list_on_empty_string(rclone_global_args, split_on=" ")
-    # get output_file
-    OUTPUT_FILE = load_key_or_default(config_dic['config'], 'output_file', default=None, ignore_empty=True)
-    # check if placeholders are used for date and time
-    def replace_regex_with_format(match_obj):
-        datetime_format = match_obj.group(1)
-        return current_datetime.strftime(datetime_format)
-    if OUTPUT_FILE is not None:       
-        OUTPUT_FILE = re.sub(DATE_TIME_REGEX, replace_regex_with_format, OUTPUT_FILE)
+    # validate the whole configuration before touching any file or drive
+    try:
+        settings = compile_settings(config_dic, current_datetime)
+    except ValueError as e:
+        print(e)
+        return 2
+    if args.plan:
+        return _run(config_dic, settings, rclone_exe, current_datetime, batch=True, plan_only=True)
+
+    if settings.output_file is not None:
+        OUTPUT_FILE = LogWriter(settings.output_file)
+    # optional json lines file with the events of each sync
+    if settings.events_file is not None:
+        EVENT_LOG = EventLog(settings.events_file)
+    # optional manifest used to skip the folders whose source did not change since the last sync
+    if settings.manifest_file is not None:
+        CHANGE_DETECTOR = ChangeDetector(settings.manifest_file)
+    try:
+        exit_code = _run(config_dic, settings, rclone_exe, current_datetime, batch=args.batch)
+    finally:
+        if CHANGE_DETECTOR is not None:
+            CHANGE_DETECTOR.save()
+        if OUTPUT_FILE is not None:
+            OUTPUT_FILE.close()
+        if EVENT_LOG is not None:
+            EVENT_LOG.close()
+    if exit_code:
+        return exit_code
+    # non-zero exit code for schedulers
+    return 1 if FAILED_JOBS else 0
+
+def _run(config_dic, settings, rclone_exe, current_datetime, batch=False, plan_only=False):
+    history = SyncHistory(settings.history_file)
 
     print_and_log(f"Starting rclone sync @ {current_datetime.strftime('%Y/%m/%d %H:%M:%S')}")
+    [print_and_log(f"WARNING: {w}") for w in settings.warnings]
     
     # list currently available drives
-    print_and_log("Collecting drive info. If there are network shares, it may take a while.")
-    curr_letters = drive_utils.list_drive_paths(list_all=extended_list_drives)
+    print_and_log("Collecting drive info.")
+    # drives are probed concurrently, the ones that do not respond within the timeout are skipped
+    curr_labeled_drives, unavailable_drives = drive_utils.list_drives(list_all=settings.extended_drive_search, timeout=settings.drive_probe_timeout)
     curr_drives = []
-    for letter in curr_letters:
+    for letter, curr_name in curr_labeled_drives:
         if letter == "C:\\":
             curr_name = "C"
-        else:
-            curr_name = drive_utils.get_name_by_drive_path(letter)
         if curr_name != "":
             curr_drives.append((letter, curr_name))
-    curr_names = [c[1] for c in curr_drives]
+    if unavailable_drives:
+        print_and_log(f"\nUnavailable drives (not responding within {settings.drive_probe_timeout} s):")
+        [print_and_log(f"{'':>15}    {d}") for d in unavailable_drives]
     
     print_and_log(f"\nCurrently available drives (label: path):")
     [print_and_log(f"{d[1]:>15}:   {d[0]}") for d in curr_drives]
-    input("\nPress Enter to continue\n")
+
+    # resolve all the folders against the available drives in a single pass, reporting all the errors at once
+    try:
+        plan = SyncPlan(settings, compile_folders(config_dic, settings, curr_drives, current_datetime))
+    except ValueError as e:
+        print_and_log(f"\n{e}")
+        return 2
+    if plan_only:
+        print_and_log(f"\n{format_plan(plan)}")
+        return 0
+    if not batch:
+        input("\nPress Enter to continue\n")
     print()
 
-    for fold in config_dic['folders']:
-        fold_id = fold['id']
-        print_and_log(f"\nSyncing id: {fold_id}")
-        # drives with common path
-        fold_has_common_paths = "path" in fold.keys()
-
-        if fold_has_common_paths:
-            # get common path
-            fold_path = fold["path"]
-            # get arguments
-            rclone_args = load_key_or_default(fold, "arguments", default="")
-            rclone_args = empty_list_on_empty_string(rclone_args, split_on=" ")
-            rclone_final_args = rclone_global_args[:] # slice to make a copy
-            rclone_final_args.extend(rclone_args)
-            rclone_final_args = [re.sub(DATE_TIME_REGEX, replace_regex_with_format, arr) for arr in rclone_final_args]
-            # get optional overwrite mode
-            rclone_current_mode = load_key_or_default(fold, 'overwrite_mode', sync_mode, ignore_empty=True)
-
-            # list of the currently connected drives or remotes
-            available_drives = [DriveObject(drive_name, curr_drives, path=fold_path) for drive_name in fold["drives"] if drive_name in curr_names]
-
-            _process_available_drives(available_drives, rclone_exe, rclone_current_mode, rclone_final_args)
+    try:
+        scheduler = DeviceScheduler(settings.max_jobs_per_device)
+        _process_folder_jobs(plan.folders, rclone_exe, settings.parallel_folders, settings.parallel_destinations, history, scheduler)
+    finally:
+        history.save()
+    if FAILED_JOBS:
+        print_and_log(f"\n{len(FAILED_JOBS)} sync(s) failed:")
+        [print_and_log(f"  {fold_id}: {source} -> {destination}: {error}") for fold_id, source, destination, error in FAILED_JOBS]
+    print_and_log("")
+    return 0
+
+def _process_folder_jobs(folder_jobs, rclone_exe, parallel_folders=1, parallel_destinations=1, history=None, scheduler=None):
+    # run the folders, in parallel if requested: the scheduler limits the syncs that use the same device at the same time
+    def run_folder(job, label=None):
+        print_and_log(f"\nSyncing id: {job.id}")
+        try:
+            _process_available_drives(job, rclone_exe, parallel_destinations, label=label, history=history, scheduler=scheduler)
+        except Exception as e:
+            # e.g. the source changed during the walk of the change detector: the folder is not synced, in both modes
+            print_and_log(f"ERROR syncing id {job.id}: {e}")
+            with PRINT_LOCK:
+                FAILED_JOBS.append((job.id, job.drives[0].drive_name if job.drives else "-", "-", str(e)))
+
+    if parallel_folders <= 1:
+        for job in folder_jobs:
+            run_folder(job)
+        return
+
+    with ThreadPoolExecutor(max_workers=parallel_folders) as executor:
+        # the errors are handled by run_folder, list() only waits for all the folders
+        list(executor.map(lambda job: run_folder(job, label=job.id), folder_jobs))
+
+def _sync_drives(rclone_exe, rclone_current_mode, dr_a, dr_b, rclone_final_args, fold_id=None, prefix="", to_stdout=True):
+    """
+    Run rclone and log its output line by line while it runs.
+    If the event log is enabled, rclone is run with json logs and the final statistics are saved in the event log.
+    Return (error, duration) with error None if the sync was successful and duration None if it was skipped.
+    """
+    fingerprint = None
+    if CHANGE_DETECTOR is not None:
+        unchanged, fingerprint = CHANGE_DETECTOR.is_unchanged(fold_id, dr_a, dr_b, rclone_current_mode, rclone_final_args)
+        if unchanged:
+            print_and_log(f"{prefix}Source unchanged since the last sync, skipping.", skip_stdout=not to_stdout)
+            if EVENT_LOG is not None:
+                EVENT_LOG.write("skipped", id=fold_id, source=dr_a.drive_name, destination=dr_b.drive_name, mode=rclone_current_mode)
+            return None, None
+    command = [rclone_exe, rclone_current_mode, dr_a.path, dr_b.path, *rclone_final_args]
+    use_json = EVENT_LOG is not None
+    if use_json and "--use-json-log" not in rclone_final_args:
+        # stats at notice level, so that the final ones are printed also without -v
+        command += ["--use-json-log", "--stats-log-level", "NOTICE"]
+    job_info = {"id": fold_id, "source": dr_a.drive_name, "destination": dr_b.drive_name, "mode": rclone_current_mode}
+    if use_json:
+        EVENT_LOG.write("start", **job_info)
+    stats = {}
+    error = None
+    start_time = time.perf_counter()
+    try:
+        for line in process_utils.stream_command(command, shell=False):
+            line = line.rstrip("\n")
+            if use_json:
+                line, line_stats = parse_rclone_json_line(line)
+                if line_stats is not None:
+                    stats = line_stats
+            print_and_log(f"{prefix}{line}", skip_stdout=not to_stdout)
+    except subprocess.CalledProcessError as e:
+        error = f"rclone exited with code {e.returncode}"
+    except OSError as e:
+        error = str(e)
+    duration = time.perf_counter() - start_time
+    if use_json:
+        EVENT_LOG.write("end", **job_info, duration=round(duration, 3), error=error,
+            bytes=stats.get("bytes"), files=stats.get("transfers"), checks=stats.get("checks"),
+            deletes=stats.get("deletes"), errors=stats.get("errors"))
+    if error is not None:
+        with PRINT_LOCK:
+            FAILED_JOBS.append((fold_id, dr_a.drive_name, dr_b.drive_name, error))
+    if CHANGE_DETECTOR is not None:
+        # the destination changed (e.g. it may be the source of a relay)
+        CHANGE_DETECTOR.invalidate(dr_b)
+        if error is None and "--dry-run" not in rclone_final_args:
+            CHANGE_DETECTOR.mark_synced(fold_id, dr_a, dr_b, rclone_current_mode, rclone_final_args, fingerprint)
+    return error, duration
 
+def _sync_pairs(pairs, job, rclone_exe, parallel_destinations=1, label=None, history=None, scheduler=None):
+    """
+    Sync each pair (source DriveObject, destination DriveObject) of the FolderJob, each one with its own arguments.
+    If a DeviceScheduler is given, each sync waits for a free slot on the devices of its drives.
+    Return the list of destinations that were synced successfully.
+    """
+    fold_id = job.id
+    synced = []
+
+    def sync(dr_a, dr_b, prefix="", to_stdout=True):
+        if scheduler is None:
+            return _sync_drives(rclone_exe, job.mode, dr_a, dr_b, job.pair_arguments(dr_a, dr_b), fold_id, prefix, to_stdout)
+        with scheduler.slot(dr_a, dr_b):
+            return _sync_drives(rclone_exe, job.mode, dr_a, dr_b, job.pair_arguments(dr_a, dr_b), fold_id, prefix, to_stdout)
+
+    if parallel_destinations <= 1 and label is None:
+        for dr_a, dr_b in pairs:
+            print_and_log(f"Syncing drives: {dr_a.drive_name} -> {dr_b.drive_name}")
+            error, duration = sync(dr_a, dr_b)
+            if error:
+                print_and_log(f"ERROR: {error}")
+            else:
+                synced.append(dr_b)
+                if history is not None and duration is not None:
+                    history.record(fold_id, dr_b.drive_name, duration)
+        return synced
+    # fan out to all the destinations, each line of output is prefixed with its destination and written only to the log
+    prefix = f"[{label}] " if label is not None else ""
+    with ThreadPoolExecutor(max_workers=max(1, parallel_destinations)) as executor:
+        futures = {}
+        for dr_a, dr_b in pairs:
+            print_and_log(f"{prefix}Syncing drives: {dr_a.drive_name} -> {dr_b.drive_name}")
+            line_prefix = f"{prefix}[{dr_a.drive_name} -> {dr_b.drive_name}] "
+            futures[executor.submit(sync, dr_a, dr_b, line_prefix, False)] = (dr_a, dr_b)
+        for future in as_completed(futures):
+            dr_a, dr_b = futures[future]
+            error, duration = future.result()
+            print_and_log(f"{prefix}Completed: {dr_a.drive_name} -> {dr_b.drive_name}" + (f" with ERROR: {error}" if error else ""))
+            if not error:
+                synced.append(dr_b)
+                if history is not None and duration is not None:
+                    history.record(fold_id, dr_b.drive_name, duration)
+    return synced
+
+def _choose_relay(destinations, fold_id, history=None):
+    # the relay is the local destination that synced faster in the previous runs, or the first local one
+    local_destinations = [d for d in destinations if not d.is_remote]
+    if not local_destinations:
+        return None
+    if history is not None:
+        fastest = history.fastest(fold_id, [d.drive_name for d in local_destinations])
+        if fastest is not None:
+            return [d for d in local_destinations if d.drive_name == fastest][0]
+    return local_destinations[0]
+
+def _process_available_drives(job, rclone_exe, parallel_destinations=1, label=None, history=None, scheduler=None):
+    prefix = f"[{label}] " if label is not None else ""
+    if job.missing_drives:
+        print_and_log(f"{prefix}Not available: {', '.join(job.missing_drives)}")
+    available_drives = job.drives
+    if len(available_drives) < 2:
+        print_and_log(f"{prefix}Less than two drives available, skipping.")
+        return
+    # no need to build the path: it is done at object initialization
+    source = available_drives[0]
+    destinations = available_drives[1:]
+    sync_args = (job, rclone_exe, parallel_destinations, label, history, scheduler)
+
+    relay = None
+    if job.fan_out == "relay" and len(destinations) > 1:
+        if job.mode != "sync":
+            # in copy mode the relay may contain files that are not in the source, they would be propagated to the other drives
+            print_and_log(f"{prefix}Relay fan out is supported only in sync mode, syncing all destinations from the source.")
         else:
-            # distinct paths
-            paths_list = fold["paths"]
-            # get arguments
-            rclone_args = load_key_or_default(fold, "arguments", default="")
-            rclone_args = empty_list_on_empty_string(rclone_args, split_on=" ")
-            rclone_path_args = rclone_global_args[:] # slice to make a copy
-            rclone_path_args.extend(rclone_args) 
-            # get optional overwrite mode
-            rclone_current_mode = load_key_or_default(fold, 'overwrite_mode', sync_mode, ignore_empty=True)
-
-            # list of the currently connected drives or remotes
-            available_drives = []
-            for path in paths_list:
-                drive_name = path["drive"]
-                drive_path = path["path"]
-                rclone_drive_args = load_key_or_default(path, "arguments", default="")
-                rclone_drive_args = empty_list_on_empty_string(rclone_drive_args, split_on=" ")
-                rclone_final_args = rclone_path_args[:]
-                rclone_final_args.extend(rclone_drive_args)
-                rclone_final_args = [re.sub(DATE_TIME_REGEX, replace_regex_with_format, arr) for arr in rclone_final_args]
-
-                if drive_name in curr_names:
-                    available_drives.append(DriveObject(drive_name, curr_drives, path=drive_path))
-
-            _process_available_drives(available_drives, rclone_exe, rclone_current_mode, rclone_final_args)
-    print_and_log("")
+            relay = _choose_relay(destinations, job.id, history)
 
-def _process_available_drives(available_drives, rclone_exe, rclone_current_mode, rclone_final_args):
-    if len(available_drives) > 1:
-        # no need to build the path: it is done at object initialization
-        path_a = available_drives[0].path 
-        for dr in available_drives[1:]:
-            path_b = dr.path
-            print_and_log(f"Syncing drives: {available_drives[0].drive_name} -> {dr.drive_name}")
-            output_print = process_utils.execute_command([rclone_exe, rclone_current_mode, path_a, path_b, *rclone_final_args], return_output=True)
-            print_and_log(output_print, skip_stdout=True)
+    if relay is None:
+        _sync_pairs([(source, d) for d in destinations], *sync_args)
+        return
+
+    # read the source only once: source -> relay, then relay -> all the other destinations
+    print_and_log(f"{prefix}Using {relay.drive_name} as relay for the other destinations")
+    if _sync_pairs([(source, relay)], *sync_args):
+        second_source = relay
     else:
-        print_and_log(f"Less than two drives available, skipping.")
+        print_and_log(f"{prefix}Sync of the relay failed, syncing the other destinations from the source.")
+        second_source = source
+    _sync_pairs([(second_source, d) for d in destinations if d is not relay], *sync_args)
+
+class SyncHistory:
+    """
+    Moving average of the duration of the syncs of each destination drive, per folder id, saved across runs.
+    Used to choose the fastest drive as relay.
+    """
+
+    def __init__(self, history_file=None, smoothing=0.5):
+        self.history_file = history_file
+        self.smoothing = smoothing
+        self.data = {}
+        self._lock = threading.Lock()
+        if history_file is not None and os.path.isfile(history_file):
+            with open(history_file, 'r', encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def record(self, fold_id, drive_name, duration):
+        with self._lock:
+            folder_data = self.data.setdefault(str(fold_id), {})
+            previous = folder_data.get(drive_name)
+            folder_data[drive_name] = duration if previous is None else self.smoothing * duration + (1 - self.smoothing) * previous
+
+    def fastest(self, fold_id, drive_names):
+        folder_data = self.data.get(str(fold_id), {})
+        known = [d for d in drive_names if d in folder_data]
+        if not known:
+            return None
+        return min(known, key=lambda d: folder_data[d])
+
+    def save(self):
+        if self.history_file is None:
+            return
+        with self._lock:
+            with open(self.history_file, 'w', encoding="utf-8") as f:
+                json.dump(self.data, f, indent=4)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,61 @@
+import datetime
+import json
+import threading
+
+
+class LogWriter:
+    """
+    Text log that keeps the file open for the whole run and flushes every line, so it can be followed while syncing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._file.write(f"{text}\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class EventLog:
+    """
+    JSON-lines file with one event per line, e.g. the start and the end of each sync job.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, event, **data):
+        record = {"event": event, "time": datetime.datetime.now().isoformat(timespec="seconds")}
+        record.update(data)
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def parse_rclone_json_line(line):
+    """
+    Parse a line printed by rclone with --use-json-log.
+    Return (message, stats) where stats is the dict of the transfer statistics if the line contains them, None otherwise.
+    Lines that are not json are returned unchanged.
+    """
+    if not line.startswith("{"):
+        return line, None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return line, None
+    msg = record.get("msg", line).rstrip("\n")
+    if record.get("object"):
+        msg = f"{record['object']}: {msg}"
+    return msg, record.get("stats")
@@ -0,0 +1,255 @@
+import re
+from dataclasses import dataclass
+
+from openscripts.io import drive_utils
+from DriveObject import DriveObject, REMOTE_PREFIX
+
+DATE_TIME_PATTERN = re.compile(r"\$datetime{(.*?)}")
+SYNC_MODES = ["copy", "sync"]
+FAN_OUT_MODES = ["star", "relay"]
+BANDWIDTH_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([BKMGTP]?)$", re.IGNORECASE)
+BANDWIDTH_UNITS = "BKMGTP"
+
+
+def load_key_or_default(dict, key, default="", ignore_empty=False):
+    # given a dictionary, check if a key exists, if it exists return it, otherwise return the 'default' param
+    # if ignore_empty is true return the default parameter also if the key is present but is an empty string or list
+    if key in dict.keys():
+        val = dict[key]
+        # return default if it is not a number or bool (bool is a subclass of int) and is either an empty string or an empty list
+        if ignore_empty and not isinstance(val, (int, float)) and (len(dict[key])==0):
+            return default
+        return dict[key]
+    else:
+        return default
+
+def empty_list_on_empty_string(s, split_on=" "):
+    # split a string on a given subset of characters
+    # if the string is empty return an empty list
+    return s.split(split_on) if s.strip() != "" else []
+
+def parse_bandwidth(value):
+    # parse a bandwidth like rclone --bwlimit (e.g. 10M, 512K or 100 which is in KiB/s) and return it in bytes per second
+    match = BANDWIDTH_PATTERN.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Invalid bandwidth: {value}")
+    unit = match.group(2).upper() or "K"
+    return float(match.group(1)) * 1024 ** BANDWIDTH_UNITS.index(unit)
+
+def replace_datetime(s, current_datetime):
+    # replace all the $datetime{format} placeholders with the current date and time
+    return DATE_TIME_PATTERN.sub(lambda m: current_datetime.strftime(m.group(1)), s)
+
+
+@dataclass(frozen=True)
+class SyncSettings:
+    sync_mode: str
+    arguments: tuple # global rclone arguments, with placeholders already replaced
+    parallel_destinations: int = 1
+    parallel_folders: int = 1
+    fan_out: str = "star"
+    extended_drive_search: bool = False
+    drive_probe_timeout: float = drive_utils.PROBE_TIMEOUT
+    output_file: str | None = None
+    events_file: str | None = None
+    history_file: str | None = None
+    manifest_file: str | None = None
+    max_jobs_per_device: int = 1
+    bandwidth_limits: tuple = () # (drive name, bytes per second) of the remotes with a bandwidth cap
+    warnings: tuple = () # valid but probably unwanted settings, to show to the user
+
+
+@dataclass(frozen=True)
+class FolderJob:
+    """
+    A folder to sync, with the drives that are currently available in order (the first is the source).
+        arguments: rclone arguments of the folder (global + folder level)
+        drive_arguments: tuple of (drive name, arguments) with the arguments of each drive (only for folders with distinct paths)
+        missing_drives: configured drives that are not currently available
+        bandwidth_limits: tuple of (drive name, --bwlimit value) with the limit of each rclone process that uses the drive
+    """
+    id: str
+    mode: str
+    fan_out: str
+    drives: tuple
+    arguments: tuple
+    drive_arguments: tuple = ()
+    missing_drives: tuple = ()
+    bandwidth_limits: tuple = ()
+
+    def pair_arguments(self, dr_a, dr_b):
+        # arguments of a sync between two drives: folder arguments + the arguments of both drives + the bandwidth limit
+        drive_args = dict(self.drive_arguments)
+        args = [*self.arguments, *drive_args.get(dr_a.drive_name, ()), *drive_args.get(dr_b.drive_name, ())]
+        limits = dict(self.bandwidth_limits)
+        pair_limits = [limits[d.drive_name] for d in (dr_a, dr_b) if d.drive_name in limits]
+        # an explicit --bwlimit in the arguments has the precedence
+        if pair_limits and not any(a.startswith("--bwlimit") for a in args):
+            args += ["--bwlimit", f"{int(min(pair_limits))}B"]
+        return args
+
+
+@dataclass(frozen=True)
+class SyncPlan:
+    settings: SyncSettings
+    folders: tuple
+
+
+def compile_settings(config_dic, current_datetime):
+    """
+    Validate the global section of the configuration and return the SyncSettings.
+    Raise ValueError with the list of all the errors found.
+    """
+    errors = []
+    if not isinstance(config_dic, dict) or not isinstance(config_dic.get("config"), dict):
+        raise ValueError("The configuration must contain a 'config' section")
+    conf = config_dic["config"]
+
+    sync_mode = conf.get("sync_mode")
+    if sync_mode not in SYNC_MODES:
+        errors.append(f"Invalid sync mode: {sync_mode}, must be one of {SYNC_MODES}")
+    fan_out = load_key_or_default(conf, "fan_out", default="star", ignore_empty=True)
+    if fan_out not in FAN_OUT_MODES:
+        errors.append(f"Invalid fan out mode: {fan_out}, must be one of {FAN_OUT_MODES}")
+    numbers = {}
+    for key, default in [("parallel_destinations", 1), ("parallel_folders", 1), ("drive_probe_timeout", drive_utils.PROBE_TIMEOUT)]:
+        numbers[key] = load_key_or_default(conf, key, default=default, ignore_empty=True)
+        if isinstance(numbers[key], bool) or not isinstance(numbers[key], (int, float)) or numbers[key] <= 0:
+            errors.append(f"Invalid value for {key}: {numbers[key]}, must be a positive number")
+    # by default a device can be used by as many syncs as the destinations synced in parallel, so that they can share the source
+    max_jobs_per_device = load_key_or_default(conf, "max_jobs_per_device", default=numbers["parallel_destinations"], ignore_empty=True)
+    if isinstance(max_jobs_per_device, bool) or not isinstance(max_jobs_per_device, int) or max_jobs_per_device <= 0:
+        errors.append(f"Invalid value for max_jobs_per_device: {max_jobs_per_device}, must be a positive integer")
+    warnings = []
+    if not errors and max_jobs_per_device < numbers["parallel_destinations"]:
+        # each sync takes a slot also on the device of the source, so the destinations of a folder cannot run all together
+        warnings.append(f"parallel_destinations ({numbers['parallel_destinations']}) is greater than max_jobs_per_device ({max_jobs_per_device}): "
+            f"at most {max_jobs_per_device} destinations of a folder are synced at the same time, since they share the source device")
+    bandwidth_limits = load_key_or_default(conf, "bandwidth_limits", default={}, ignore_empty=True)
+    if not isinstance(bandwidth_limits, dict):
+        errors.append("bandwidth_limits must be a mapping from remote name to bandwidth")
+        bandwidth_limits = {}
+    parsed_limits = []
+    for drive_name, value in bandwidth_limits.items():
+        if not str(drive_name).startswith(REMOTE_PREFIX):
+            errors.append(f"Bandwidth limit for {drive_name}: limits are supported only for remotes (names starting with {REMOTE_PREFIX})")
+            continue
+        try:
+            parsed_limits.append((drive_name, parse_bandwidth(value)))
+        except ValueError as e:
+            errors.append(f"Bandwidth limit for {drive_name}: {e}")
+    files = {}
+    for key in ["output_file", "events_file", "history_file", "manifest_file"]:
+        files[key] = load_key_or_default(conf, key, default=None, ignore_empty=True)
+        if files[key] is not None:
+            files[key] = replace_datetime(str(files[key]), current_datetime)
+    arguments = load_key_or_default(conf, "arguments", default="", ignore_empty=False) or ""
+    if errors:
+        raise ValueError("Invalid configuration:\n" + "\n".join(f"  - {e}" for e in errors))
+    return SyncSettings(
+        sync_mode=sync_mode,
+        arguments=tuple(replace_datetime(a, current_datetime) for a in empty_list_on_empty_string(arguments)),
+        fan_out=fan_out,
+        extended_drive_search=bool(load_key_or_default(conf, "extended_drive_search", default=False, ignore_empty=True)),
+        max_jobs_per_device=max_jobs_per_device,
+        bandwidth_limits=tuple(parsed_limits),
+        warnings=tuple(warnings),
+        **numbers,
+        **files,
+    )
+
+
+def compile_folders(config_dic, settings, curr_drives, current_datetime):
+    """
+    Validate the folders of the configuration and resolve them against the currently available drives.
+        curr_drives: list of tuples (path, label) of the connected drives
+    Return the tuple of FolderJob. Raise ValueError with the list of all the errors found.
+    """
+    errors = []
+    jobs = []
+    seen_ids = set()
+    curr_names = {c[1] for c in curr_drives}
+    # the cap of a remote is shared among the syncs that may use it at the same time
+    bandwidth_limits = tuple((name, limit / settings.max_jobs_per_device) for name, limit in settings.bandwidth_limits)
+
+    def is_available(drive_name):
+        # remotes are always considered available, rclone will report if they are not
+        return drive_name in curr_names or str(drive_name).startswith(REMOTE_PREFIX)
+
+    def parse_arguments(d):
+        return [replace_datetime(a, current_datetime) for a in empty_list_on_empty_string(load_key_or_default(d, "arguments", default="") or "")]
+
+    for index, fold in enumerate(config_dic.get("folders") or []):
+        fold_id = fold.get("id") if isinstance(fold, dict) else None
+        if fold_id is None:
+            errors.append(f"Folder #{index + 1} has no id")
+            continue
+        if fold_id in seen_ids:
+            errors.append(f"Duplicated folder id: {fold_id}")
+        seen_ids.add(fold_id)
+        mode = load_key_or_default(fold, "overwrite_mode", settings.sync_mode, ignore_empty=True)
+        if mode not in SYNC_MODES:
+            errors.append(f"{fold_id}: invalid overwrite mode {mode}")
+        fan_out = load_key_or_default(fold, "fan_out", settings.fan_out, ignore_empty=True)
+        if fan_out not in FAN_OUT_MODES:
+            errors.append(f"{fold_id}: invalid fan out mode {fan_out}")
+        arguments = (*settings.arguments, *parse_arguments(fold))
+
+        if ("path" in fold) == ("paths" in fold):
+            errors.append(f"{fold_id}: exactly one between 'path' and 'paths' must be defined")
+            continue
+        drives = []
+        drive_arguments = []
+        missing = []
+        if "path" in fold:
+            # drives with common path
+            if not fold.get("drives"):
+                errors.append(f"{fold_id}: 'drives' must be a non empty list")
+                continue
+            for drive_name in fold["drives"]:
+                if is_available(drive_name):
+                    drives.append(DriveObject(drive_name, curr_drives, path=fold["path"]))
+                else:
+                    missing.append(drive_name)
+        else:
+            # distinct paths, each one with its optional arguments
+            for path in fold["paths"] or []:
+                if "drive" not in path or "path" not in path:
+                    errors.append(f"{fold_id}: each entry of 'paths' must define 'drive' and 'path'")
+                    continue
+                if is_available(path["drive"]):
+                    drives.append(DriveObject(path["drive"], curr_drives, path=path["path"]))
+                    drive_arguments.append((path["drive"], tuple(parse_arguments(path))))
+                else:
+                    missing.append(path["drive"])
+        jobs.append(FolderJob(
+            id=fold_id,
+            mode=mode,
+            fan_out=fan_out,
+            drives=tuple(drives),
+            arguments=tuple(arguments),
+            drive_arguments=tuple(drive_arguments),
+            missing_drives=tuple(missing),
+            bandwidth_limits=bandwidth_limits,
+        ))
+    if errors:
+        raise ValueError("Invalid configuration:\n" + "\n".join(f"  - {e}" for e in errors))
+    return tuple(jobs)
+
+
+def format_plan(plan):
+    # human readable summary of the plan, for dry runs
+    lines = [f"Sync plan: {len(plan.folders)} folders, default mode {plan.settings.sync_mode}, "
+        f"{plan.settings.parallel_folders} folders and {plan.settings.parallel_destinations} destinations in parallel, "
+        f"at most {plan.settings.max_jobs_per_device} syncs per device"]
+    for job in plan.folders:
+        lines.append(f"\n[{job.id}] mode: {job.mode}, fan out: {job.fan_out}")
+        if len(job.drives) < 2:
+            lines.append("  less than two drives available, skipped")
+        else:
+            source = job.drives[0]
+            for dr in job.drives[1:]:
+                lines.append(f"  {source.drive_name} -> {dr.drive_name}: {source.path} -> {dr.path} {' '.join(job.pair_arguments(source, dr))}".rstrip())
+        if job.missing_drives:
+            lines.append(f"  not available: {', '.join(job.missing_drives)}")
+    return "\n".join(lines)
@@ -0,0 +1,270 @@
+import cmath
+import math
+import os
+import sqlite3
+import subprocess
+import wave
+from array import array
+from collections import defaultdict
+from pathlib import Path
+
+# Acoustic fingerprints to find the same audio also when it was re-encoded, trimmed or renamed.
+# Each frame of the audio becomes a 32 bit sub-fingerprint: bit b is set if the energy difference between the frequency bands b and b + 1
+# increased from the previous frame (Haitsma and Kalker). Re-encoding flips only a few bits, so two files are compared with
+# the bit error rate of their sub-fingerprints aligned at the best offset, which also handles different intros.
+
+SAMPLE_RATE = 4000 # audio is decoded to mono at this rate, enough for voices
+FRAME_SIZE = 1024 # 256 ms
+HOP_SIZE = 256 # 64 ms between the sub-fingerprints
+N_BANDS = 33 # log spaced bands between MIN_FREQ and MAX_FREQ, giving 32 bits
+MIN_FREQ = 100
+MAX_FREQ = 1900
+DURATION = 120 # seconds decoded from the beginning of each file
+INDEX_STEP = 8 # only one sub-fingerprint every INDEX_STEP frames (~0.5 s) is added to the index
+LSH_BANDS = ((0, 24), (8, 24)) # (shift, bits) of the overlapping bands of the sub-fingerprints used as index keys
+MAX_BER = 0.2 # maximum bit error rate of two matching files (a re-encode is ~0.05, different audio ~0.5)
+MIN_OVERLAP = 150 # minimum number of aligned informative frames (~10 s) to compare two files
+# sub-fingerprints without information: silence gives all zeros, so files that share only silence would match
+TRIVIAL_SUB_FINGERPRINTS = (0, (1 << (N_BANDS - 1)) - 1)
+MAX_CANDIDATES = 20 # candidate alignments verified for each query
+
+
+def decode_audio(file_path, duration=DURATION, ffmpeg="ffmpeg"):
+    """
+    Decode the first duration seconds of a file to mono 16 bit samples at SAMPLE_RATE.
+    Wav files are decoded in python, the other formats with ffmpeg.
+    """
+    if Path(file_path).suffix.lower() == ".wav":
+        return _decode_wav(file_path, duration)
+    command = [ffmpeg, "-v", "error", "-nostdin", "-i", str(file_path), "-t", str(duration), "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    res = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    samples = array("h")
+    samples.frombytes(res.stdout[:len(res.stdout) // 2 * 2])
+    return samples
+
+
+def _decode_wav(file_path, duration):
+    # only 16 bit pcm, channels are averaged and the rate is converted by taking the closest sample
+    with wave.open(str(file_path), "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"Unsupported wav sample width: {w.getsampwidth()}")
+        channels = w.getnchannels()
+        rate = w.getframerate()
+        data = array("h")
+        data.frombytes(w.readframes(int(duration * rate)))
+    if channels > 1:
+        data = [sum(data[i:i + channels]) // channels for i in range(0, len(data) - channels + 1, channels)]
+    step = rate / SAMPLE_RATE
+    return array("h", [data[int(i * step)] for i in range(int(len(data) / step))])
+
+
+def _fft(values, twiddles):
+    # iterative radix 2 fft, len(values) must be a power of two
+    n = len(values)
+    a = list(values)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            a[i], a[j] = a[j], a[i]
+    size = 2
+    while size <= n:
+        half = size // 2
+        w = twiddles[size]
+        for start in range(0, n, size):
+            for k in range(half):
+                u = a[start + k]
+                v = a[start + k + half] * w[k]
+                a[start + k] = u + v
+                a[start + k + half] = u - v
+        size *= 2
+    return a
+
+
+def compute_fingerprint(samples):
+    """
+    Return the array of 32 bit sub-fingerprints, one every HOP_SIZE samples.
+    """
+    window = [0.5 - 0.5 * math.cos(2 * math.pi * i / FRAME_SIZE) for i in range(FRAME_SIZE)]
+    twiddles = {}
+    size = 2
+    while size <= FRAME_SIZE:
+        twiddles[size] = [cmath.exp(-2j * math.pi * k / size) for k in range(size // 2)]
+        size *= 2
+    # fft bins of the edges of the bands
+    edges = [MIN_FREQ * (MAX_FREQ / MIN_FREQ) ** (b / N_BANDS) for b in range(N_BANDS + 1)]
+    bins = [min(FRAME_SIZE // 2, round(e * FRAME_SIZE / SAMPLE_RATE)) for e in edges]
+    bands = [(bins[b], max(bins[b + 1], bins[b] + 1)) for b in range(N_BANDS)]
+
+    fingerprint = array("I")
+    previous = None
+    for start in range(0, len(samples) - FRAME_SIZE + 1, HOP_SIZE):
+        spectrum = _fft([samples[start + i] * window[i] for i in range(FRAME_SIZE)], twiddles)
+        power = [abs(x) ** 2 for x in spectrum[:FRAME_SIZE // 2 + 1]]
+        energies = [sum(power[lo:hi]) for lo, hi in bands]
+        differences = [energies[b] - energies[b + 1] for b in range(N_BANDS - 1)]
+        if previous is not None:
+            sub_fingerprint = 0
+            for b in range(N_BANDS - 1):
+                if differences[b] - previous[b] > 0:
+                    sub_fingerprint |= 1 << b
+            fingerprint.append(sub_fingerprint)
+        previous = differences
+    return fingerprint
+
+
+def fingerprint_file(file_path, duration=DURATION, ffmpeg="ffmpeg"):
+    return compute_fingerprint(decode_audio(file_path, duration, ffmpeg))
+
+
+def bit_error_rate(fp_a, fp_b, offset):
+    """
+    Return (bit error rate, number of aligned frames) of two fingerprints, where frame i of fp_a is aligned to frame i + offset of fp_b.
+    The frames where either sub-fingerprint is trivial (e.g. silence) are skipped and not counted.
+    """
+    errors = 0
+    overlap = 0
+    for i in range(max(0, -offset), min(len(fp_a), len(fp_b) - offset)):
+        a, b = fp_a[i], fp_b[i + offset]
+        if a in TRIVIAL_SUB_FINGERPRINTS or b in TRIVIAL_SUB_FINGERPRINTS:
+            continue
+        errors += (a ^ b).bit_count()
+        overlap += 1
+    if overlap == 0:
+        return 1.0, 0
+    return errors / (32 * overlap), overlap
+
+
+def lsh_keys(sub_fingerprint):
+    # one key for each band, the band index is in the high bits so that the keys of different bands never collide.
+    # Trivial sub-fingerprints have no keys, or all the files with some silence would share them
+    if sub_fingerprint in TRIVIAL_SUB_FINGERPRINTS:
+        return []
+    return [(band << 32) | ((sub_fingerprint >> shift) & ((1 << bits) - 1)) for band, (shift, bits) in enumerate(LSH_BANDS)]
+
+
+class FingerprintIndex:
+    """
+    Persistent index (sqlite) of the fingerprints of the audio files, valid as long as size and mtime of the files do not change.
+    The index keys are bands of the bits of the sub-fingerprints (banded LSH): a query looks up the keys of all its frames,
+    votes the (file, offset) alignments that share a key and verifies only the most voted ones with the bit error rate,
+    so the cost does not grow with the number of pairs of files.
+    Since a band is a key only if all its bits match, the recall drops quickly with the bit error rate: copies up to ~0.2 share
+    plenty of keys, while above ~0.25 most of them share less than the two keys needed to be verified, whatever max_ber is.
+    """
+
+    def __init__(self, db_path=":memory:"):
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(db_path)
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, fingerprint BLOB NOT NULL)"
+        )
+        self._con.execute("CREATE TABLE IF NOT EXISTS postings (key INTEGER NOT NULL, file_id INTEGER NOT NULL, position INTEGER NOT NULL)")
+        self._con.execute("CREATE INDEX IF NOT EXISTS postings_key ON postings (key)")
+        self._con.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._con.commit()
+        self._con.close()
+
+    @staticmethod
+    def _key(file_path):
+        return str(Path(file_path).resolve())
+
+    def get(self, file_path):
+        """
+        Return the fingerprint of the file, or None if it is not in the index or if the file changed.
+        """
+        row = self._con.execute("SELECT size, mtime_ns, fingerprint FROM files WHERE path = ?", (self._key(file_path),)).fetchone()
+        if row is None:
+            return None
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        if (st.st_size, st.st_mtime_ns) != tuple(row[:2]):
+            return None
+        fingerprint = array("I")
+        fingerprint.frombytes(row[2])
+        return fingerprint
+
+    def add(self, file_path, fingerprint):
+        self.remove(file_path)
+        st = os.stat(file_path)
+        file_id = self._con.execute(
+            "INSERT INTO files (path, size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?)",
+            (self._key(file_path), st.st_size, st.st_mtime_ns, fingerprint.tobytes())
+        ).lastrowid
+        self._con.executemany(
+            "INSERT INTO postings (key, file_id, position) VALUES (?, ?, ?)",
+            [(key, file_id, position) for position in range(0, len(fingerprint), INDEX_STEP) for key in lsh_keys(fingerprint[position])]
+        )
+
+    def remove(self, file_path):
+        row = self._con.execute("SELECT id FROM files WHERE path = ?", (self._key(file_path),)).fetchone()
+        if row is not None:
+            self._con.execute("DELETE FROM postings WHERE file_id = ?", row)
+            self._con.execute("DELETE FROM files WHERE id = ?", row)
+
+    def query(self, fingerprint, max_ber=MAX_BER, exclude=None):
+        """
+        Return the list of (path, bit error rate, offset in seconds) of the indexed files that match the fingerprint, best first.
+        The offset is positive if the audio starts later in the indexed file.
+        """
+        positions = defaultdict(list) # key -> frames of the query
+        for i, sub_fingerprint in enumerate(fingerprint):
+            for key in lsh_keys(sub_fingerprint):
+                positions[key].append(i)
+        votes = defaultdict(int) # (file id, offset) -> number of shared keys
+        keys = list(positions)
+        for chunk_start in range(0, len(keys), 900):
+            chunk = keys[chunk_start:chunk_start + 900]
+            rows = self._con.execute(f"SELECT key, file_id, position FROM postings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, file_id, position in rows:
+                for i in positions[key]:
+                    votes[(file_id, position - i)] += 1
+
+        n_informative = sum(1 for s in fingerprint if s not in TRIVIAL_SUB_FINGERPRINTS)
+        exclude_key = self._key(exclude) if exclude is not None else None
+        matches = {}
+        for (file_id, offset), n_votes in sorted(votes.items(), key=lambda v: -v[1])[:MAX_CANDIDATES]:
+            if n_votes < 2 or file_id in matches:
+                continue
+            path, blob = self._con.execute("SELECT path, fingerprint FROM files WHERE id = ?", (file_id,)).fetchone()
+            if path == exclude_key:
+                continue
+            indexed = array("I")
+            indexed.frombytes(blob)
+            ber, overlap = bit_error_rate(fingerprint, indexed, offset)
+            if overlap >= min(MIN_OVERLAP, n_informative) and ber <= max_ber:
+                matches[file_id] = (path, ber, offset * HOP_SIZE / SAMPLE_RATE)
+        return sorted(matches.values(), key=lambda m: m[1])
+
+    def prune(self):
+        """
+        Remove the files that no longer exist or that changed. Return the number of removed files.
+        """
+        removed = 0
+        for path, size, mtime_ns in self._con.execute("SELECT path, size, mtime_ns FROM files").fetchall():
+            try:
+                st = os.stat(path)
+                changed = (st.st_size, st.st_mtime_ns) != (size, mtime_ns)
+            except OSError:
+                changed = True
+            if changed:
+                self.remove(path)
+                removed += 1
+        self._con.commit()
+        return removed
@@ -0,0 +1,117 @@
+import argparse
+import itertools
+import json
+import random
+import re
+import string
+import time
+
+from name_cleaner import NameCleaner, de_emojify
+
+# Microbenchmark of the cleaning of the titles of retag.py as the number of words of the author/album name grows.
+# The previous implementation, which tried every permutation of the words with a regex, is included for comparison.
+
+# symbols and text without emoji, that de_emojify must not change (the zero width joiner is part of the devanagari text)
+NON_EMOJI_SYMBOLS = list("✓✗✘❶❷➜➔→⇒∞±×÷€£§¶•…①②③❝❞⊕") + ["Épisode 3 — 日本語", "क्\u200dष"]
+
+def legacy_remove_all_permutations(chunks, full_string):
+    # previous implementation, factorial in the number of words (emoji removal omitted)
+    for perm in itertools.permutations(chunks):
+        all_lower = " ".join(perm)
+        full_string = re.sub(f'{all_lower}$', '', full_string)
+        full_string = re.sub(f'^{all_lower}', '', full_string)
+        first_upper = [s[0].upper() + s[1:] if len(s) > 1 else s.upper() for s in perm]
+        for i in range(len(perm)):
+            perm_t = list(perm).copy()
+            perm_t[i] = first_upper[i]
+            my_string = " ".join(perm_t)
+            full_string = re.sub(f'{my_string}$', '', full_string)
+            full_string = re.sub(f'^{my_string}', '', full_string)
+            for j in range(len(perm)):
+                perm_t[j] = first_upper[j]
+                my_string = " ".join(perm_t)
+                full_string = re.sub(f'{my_string}$', '', full_string)
+                full_string = re.sub(f'^{my_string}', '', full_string)
+    return full_string
+
+def random_words(rng, n):
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8))) for _ in range(n)]
+
+def make_titles(rng, name_words, n_titles):
+    # half of the titles start with the name in a random order, the others do not contain it
+    titles = []
+    for i in range(n_titles):
+        episode = " ".join(random_words(rng, 5))
+        if i % 2 == 0:
+            shuffled = rng.sample(name_words, len(name_words))
+            titles.append(" ".join(w.capitalize() for w in shuffled) + " - " + episode)
+        else:
+            titles.append(episode)
+    return titles
+
+def time_per_title(function, titles, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for t in titles:
+            function(t)
+    return (time.perf_counter() - start_time) / (repeat * len(titles))
+
+def benchmark_emoji(titles, repeat):
+    """
+    Compare de_emojify with the emoji package, which is imported only here, and check that it removes all its emoji.
+    """
+    start_time = time.perf_counter()
+    import emoji
+    import_time = time.perf_counter() - start_time
+    missed = [e for e in emoji.EMOJI_DATA if de_emojify(e) != ""]
+    print(f"> Emoji package: imported in {import_time * 1000:.1f} ms, {len(missed)} of its {len(emoji.EMOJI_DATA)} emoji not removed by de_emojify {missed[:10]}")
+    # symbols that are not emoji must be kept, as the emoji package does
+    removed = [c for c in NON_EMOJI_SYMBOLS if de_emojify(c) != c or emoji.replace_emoji(c, '') != c]
+    print(f"> {len(removed)} of {len(NON_EMOJI_SYMBOLS)} non emoji symbols removed by de_emojify {removed[:10]}")
+    assert not missed and not removed, "de_emojify does not match the emoji package"
+    rng = random.Random(0)
+    all_emoji = list(emoji.EMOJI_DATA)
+    emoji_titles = [t + " " + rng.choice(all_emoji) if i % 2 == 0 else t for i, t in enumerate(titles)]
+    table_us = time_per_title(de_emojify, emoji_titles, repeat) * 1e6
+    package_us = time_per_title(lambda t: emoji.replace_emoji(t, ''), emoji_titles, repeat) * 1e6
+    print(f"> Emoji removal: {table_us:.2f} us per title, emoji.replace_emoji {package_us:.2f} us")
+    return {"emoji_missed": len(missed), "de_emojify_us": round(table_us, 3), "replace_emoji_us": round(package_us, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the title cleaning of retag.py')
+    parser.add_argument('--max-words', help='Maximum number of words of the name', type=int, default=32)
+    parser.add_argument('--legacy-max-words', help='Maximum number of words for the previous implementation (factorial time)', type=int, default=6)
+    parser.add_argument('--titles', help='Number of titles cleaned for each name', type=int, default=200)
+    parser.add_argument('--repeat', help='Repetitions', type=int, default=5)
+    parser.add_argument('--check-emoji', help='Compare the emoji removal with the emoji package (must be installed)', action='store_true')
+    parser.add_argument('--output', help='Save the results as json', type=str)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = []
+    n_words = 1
+    while n_words <= args.max_words:
+        name_words = random_words(rng, n_words)
+        titles = make_titles(rng, name_words, args.titles)
+        # the cleaner is built once per name, as in retag.py
+        cleaner = NameCleaner(" ".join(name_words))
+        row = {"words": n_words, "cleaner_us": round(time_per_title(cleaner.clean, titles, args.repeat) * 1e6, 3)}
+        if n_words <= args.legacy_max_words:
+            legacy_titles = titles[:max(1, args.titles // 20)]
+            row["legacy_us"] = round(time_per_title(lambda t: legacy_remove_all_permutations(name_words, t), legacy_titles, 1) * 1e6, 3)
+        results.append(row)
+        legacy = f", previous implementation {row['legacy_us']:.1f} us" if "legacy_us" in row else ""
+        print(f"> {n_words:>3} words: {row['cleaner_us']:.2f} us per title{legacy}")
+        n_words = n_words + 1 if n_words < args.legacy_max_words else n_words * 2
+
+    results = {"name_cleaner": results}
+    if args.check_emoji:
+        results["emoji"] = benchmark_emoji(make_titles(rng, random_words(rng, 3), args.titles), args.repeat)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    # usage e.g. python benchmark_name_cleaner.py --max-words 64 --legacy-max-words 7
+    main()
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import struct
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+
+from acoustic_fingerprint import FingerprintIndex, fingerprint_file, MAX_BER
+
+# content: files with the same bytes
+# audio: files with the same audio data, ignoring the tags (only for mp4 files, the others are compared by content)
+# name: files with the same name (without extension) in any folder
+# fingerprint: files that sound the same, also if re-encoded or trimmed (requires ffmpeg for formats other than wav)
+MATCH_MODES = ["audio", "content", "name", "fingerprint"]
+MP4_EXTENSIONS = {".m4a", ".m4b", ".mp4"}
+PARTIAL_SIZE = 64 * 1024 # bytes hashed at the beginning and at the end of the data in the partial hash
+CHUNK_SIZE = 1024 * 1024
+
+
+def mp4_audio_ranges(file_path):
+    """
+    Return the list of (offset, length) of the payload of the top level mdat atoms of a mp4 file, i.e. the audio data without the tags.
+    Return None if the file is not a valid mp4 file.
+    """
+    ranges = []
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, name = struct.unpack(">I4s", f.read(8))
+            header_size = 8
+            if size == 1:
+                # 64 bit size
+                if offset + 16 > file_size:
+                    return None
+                size = struct.unpack(">Q", f.read(8))[0]
+                header_size = 16
+            elif size == 0:
+                # the atom extends to the end of the file
+                size = file_size - offset
+            if size < header_size or offset + size > file_size:
+                return None
+            if name == b"mdat":
+                ranges.append((offset + header_size, size - header_size))
+            offset += size
+    return ranges if offset == file_size else None
+
+
+def payload_ranges(file_path, mode):
+    # ranges of the file that are compared, the whole file unless only the audio is compared
+    if mode == "audio" and Path(file_path).suffix.lower() in MP4_EXTENSIONS:
+        ranges = mp4_audio_ranges(file_path)
+        if ranges is not None:
+            return ranges
+    return [(0, os.path.getsize(file_path))]
+
+
+def hash_ranges(file_path, ranges, partial=False):
+    """
+    Hash the given (offset, length) ranges of a file.
+    If partial is true only the first and the last PARTIAL_SIZE bytes of the data are hashed.
+    """
+    total = sum(length for _, length in ranges)
+    if partial and total > 2 * PARTIAL_SIZE:
+        ranges = _sub_ranges(ranges, 0, PARTIAL_SIZE) + _sub_ranges(ranges, total - PARTIAL_SIZE, PARTIAL_SIZE)
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            while length > 0:
+                data = f.read(min(CHUNK_SIZE, length))
+                if not data:
+                    break
+                digest.update(data)
+                length -= len(data)
+    return digest.hexdigest()
+
+
+def _safe_fingerprint_file(file_path):
+    # run in a separate process: errors are returned rather than raised, so that a bad file does not stop the others
+    try:
+        return fingerprint_file(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _sub_ranges(ranges, start, length):
+    # ranges of the file that contain the bytes [start, start + length) of the concatenated data
+    result = []
+    position = 0
+    for offset, range_length in ranges:
+        begin = max(start, position)
+        end = min(start + length, position + range_length)
+        if begin < end:
+            result.append((offset + begin - position, end - begin))
+        position += range_length
+    return result
+
+
+class DuplicateFinder:
+    """
+    Find groups of duplicated files.
+    Files are first grouped by size of the compared data, then the groups are refined with a partial hash and then with the full hash,
+    so only the files that have a possible duplicate are read, and only the ones that survive the partial hash are read entirely.
+    Hashes are computed in parallel and, if a ProbeCache is given, saved so that the unchanged files are never read again.
+    In fingerprint mode the files are instead added to a FingerprintIndex and each one is searched in it.
+    """
+
+    def __init__(self, mode="audio", workers=8, cache=None, index=None, max_ber=MAX_BER):
+        assert mode in MATCH_MODES, f"Invalid match mode: {mode}"
+        self.mode = mode
+        self.workers = workers
+        self.cache = cache
+        self.index = index
+        self.max_ber = max_ber
+        self.stats = {"files": 0, "computed": 0, "cached": 0} # computed and cached: number of ranges and hashes
+
+    def find(self, files):
+        """
+        Return the list of groups (lists of Path) of duplicated files, each group with at least two files.
+        """
+        files = [Path(f) for f in files]
+        self.stats["files"] = len(files)
+        if self.mode == "name":
+            by_name = defaultdict(list)
+            for f in files:
+                by_name[f.stem].append(f)
+            return [sorted(group) for group in by_name.values() if len(group) > 1]
+        if self.mode == "fingerprint":
+            return self._find_by_fingerprint(files)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # the ranges of the whole file require only a stat, they are cached only when the atoms of the file are parsed
+            ranges = self._compute(executor, files, "ranges", lambda f: payload_ranges(f, self.mode), use_cache=self.mode == "audio")
+            by_size = defaultdict(list)
+            for f in files:
+                size = sum(length for _, length in ranges[f]) if ranges.get(f) is not None else 0
+                # files without data (e.g. empty or unreadable) are never considered duplicates
+                if size > 0:
+                    by_size[size].append(f)
+            candidates = [f for group in by_size.values() if len(group) > 1 for f in group]
+
+            partial = self._compute(executor, candidates, "partial_hash", lambda f: hash_ranges(f, ranges[f], partial=True))
+            groups = self._refine([((size,), group) for size, group in by_size.items()], partial)
+
+            # the partial hash of small files already covers all the data
+            need_full = [f for key, group in groups if key[0] > 2 * PARTIAL_SIZE for f in group]
+            full = self._compute(executor, need_full, "full_hash", lambda f: hash_ranges(f, ranges[f]))
+            full.update({f: partial[f] for key, group in groups if key[0] <= 2 * PARTIAL_SIZE for f in group})
+            groups = self._refine(groups, full)
+        return [sorted(group) for _, group in groups]
+
+    def _find_by_fingerprint(self, files):
+        index = self.index if self.index is not None else FingerprintIndex()
+        fingerprints = {}
+        to_compute = []
+        for f in files:
+            fingerprints[f] = index.get(f)
+            if fingerprints[f] is None:
+                to_compute.append(f)
+        self.stats["cached"] += len(files) - len(to_compute)
+        self.stats["computed"] += len(to_compute)
+        # decoding is cpu bound python code, so it runs in separate processes; the index is accessed only from this process
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for f, (fingerprint, error) in zip(to_compute, executor.map(_safe_fingerprint_file, to_compute, chunksize=4)):
+                if error is not None:
+                    print(f"Cannot fingerprint {f}: {error}")
+                    continue
+                fingerprints[f] = fingerprint
+                index.add(f, fingerprint)
+
+        # group the files that match, also indirectly (e.g. a matches b and b matches c)
+        by_path = {str(f.resolve()): f for f in files}
+        parents = {f: f for f in files}
+
+        def root(f):
+            while parents[f] != f:
+                parents[f] = parents[parents[f]]
+                f = parents[f]
+            return f
+
+        for f in files:
+            if fingerprints[f] is None:
+                continue
+            for path, _, _ in index.query(fingerprints[f], max_ber=self.max_ber, exclude=f):
+                # files of the index that are not among the given ones are ignored
+                if path in by_path:
+                    parents[root(by_path[path])] = root(f)
+        groups = defaultdict(list)
+        for f in files:
+            groups[root(f)].append(f)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    @staticmethod
+    def _refine(groups, hashes):
+        # split each group (key, files) by hash, keeping only the groups with at least two files
+        # the key is the tuple (size, *hashes)
+        refined = []
+        for key, group in groups:
+            by_hash = defaultdict(list)
+            for f in group:
+                if hashes.get(f) is not None:
+                    by_hash[hashes[f]].append(f)
+            refined += [((*key, h), g) for h, g in by_hash.items() if len(g) > 1]
+        return refined
+
+    def _compute(self, executor, files, kind, function, use_cache=True):
+        """
+        Return a dict file -> function(file), computed in parallel for the files that are not in the cache.
+        Files that cannot be read are mapped to None.
+        """
+        results = {}
+        kind = f"{self.mode}_{kind}"
+        to_compute = []
+        cache = self.cache if use_cache else None
+        for f in files:
+            cached = cache.get(f, kind) if cache is not None else None
+            if cached is not None:
+                results[f] = cached
+                self.stats["cached"] += 1
+            else:
+                to_compute.append(f)
+
+        def safe_function(f):
+            try:
+                return function(f)
+            except OSError as e:
+                print(f"Cannot read {f}: {e}")
+                return None
+
+        # the cache is not thread safe, it is accessed only from this thread
+        self.stats["computed"] += len(to_compute)
+        for f, result in zip(to_compute, executor.map(safe_function, to_compute)):
+            results[f] = result
+            if result is not None and cache is not None:
+                cache.set(f, kind, result)
+        return results
@@ -0,0 +1,233 @@
+import csv
+import datetime
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mutagen
+
+# interactive: ask which file to keep
+# bitrate, newest, duration: keep the file with the highest bitrate, the most recent modification time or the longest duration
+# folder: keep the file in the first of the preferred folders
+POLICIES = ["interactive", "bitrate", "newest", "duration", "folder"]
+PLAN_FIELDS = ["group", "action", "file", "bitrate", "duration", "modified", "size"]
+TRASH_LOG = "trash_log.jsonl"
+
+
+def read_audio_info(file_path):
+    """
+    Return a dict with bitrate (kbps), duration (seconds), modification time and size of an audio file.
+    Bitrate and duration are None if the file cannot be parsed.
+    """
+    st = os.stat(file_path)
+    info = {"bitrate": None, "duration": None, "modified": st.st_mtime, "size": st.st_size}
+    try:
+        audio = mutagen.File(file_path)
+    except mutagen.MutagenError:
+        audio = None
+    if audio is not None:
+        info["bitrate"] = round(getattr(audio.info, "bitrate", 0) / 1000)
+        info["duration"] = round(getattr(audio.info, "length", 0.0), 3)
+    return info
+
+
+def read_audio_infos(files, workers=8, cache=None):
+    """
+    Return a dict file -> audio info, parsing each file only once in parallel.
+    If a ProbeCache is given, the info of the unchanged files is read from it.
+    """
+    infos = {}
+    to_read = []
+    for f in files:
+        cached = cache.get(f, "audio_info") if cache is not None else None
+        if cached is not None:
+            infos[f] = cached
+        else:
+            to_read.append(f)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # the cache is not thread safe, it is accessed only from this thread
+        for f, info in zip(to_read, executor.map(read_audio_info, to_read)):
+            infos[f] = info
+            if cache is not None:
+                cache.set(f, "audio_info", info)
+    return infos
+
+
+def _folder_rank(file_path, preferred_folders):
+    # index of the first preferred folder that contains the file, the number of folders if none
+    for i, folder in enumerate(preferred_folders):
+        if Path(file_path).resolve().is_relative_to(Path(folder).resolve()):
+            return i
+    return len(preferred_folders)
+
+
+def choose_file_to_keep(group, infos, policy, preferred_folders=()):
+    """
+    Return the file of the group that is kept according to the policy (not interactive).
+    Ties are broken by bitrate, then duration, then modification time, then by the order of the group.
+    """
+    def quality(f):
+        info = infos[f]
+        return (info["bitrate"] or 0, info["duration"] or 0.0, info["modified"])
+
+    if policy == "bitrate":
+        key = quality
+    elif policy == "newest":
+        key = lambda f: (infos[f]["modified"], *quality(f))
+    elif policy == "duration":
+        key = lambda f: (infos[f]["duration"] or 0.0, *quality(f))
+    elif policy == "folder":
+        key = lambda f: (-_folder_rank(f, preferred_folders), *quality(f))
+    else:
+        raise ValueError(f"Invalid policy: {policy}")
+    # max returns the first of the files with the maximum key
+    return max(group, key=key)
+
+
+def durations_agree(group, infos, max_difference):
+    """
+    True if the durations of all the files of the group are known and differ at most by max_difference seconds.
+    Used to check the groups of the acoustic fingerprints, that compare only the beginning of the files (e.g. episodes with the same intro).
+    """
+    durations = [infos[f]["duration"] for f in group]
+    if any(d is None for d in durations):
+        return False
+    return max(durations) - min(durations) <= max_difference
+
+
+def build_plan(groups, keep_files, infos):
+    """
+    Return the rows of the plan, one for each file of each group, with action keep or delete.
+        keep_files: list with the file to keep of each group
+    """
+    rows = []
+    for i, (group, keep) in enumerate(zip(groups, keep_files)):
+        for f in group:
+            info = infos.get(f, {})
+            rows.append({
+                "group": i + 1,
+                "action": "keep" if f == keep else "delete",
+                "file": str(f),
+                "bitrate": info.get("bitrate"),
+                "duration": info.get("duration"),
+                "modified": datetime.datetime.fromtimestamp(info["modified"]).isoformat(timespec="seconds") if "modified" in info else None,
+                "size": info.get("size"),
+            })
+    return rows
+
+
+def write_plan(rows, plan_path):
+    """
+    Save the plan as csv if the extension is .csv, as json otherwise.
+    """
+    plan_path = Path(plan_path)
+    plan_path.parent.mkdir(parents=True, exist_ok=True)
+    if plan_path.suffix.lower() == ".csv":
+        with open(plan_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=PLAN_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(plan_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=4)
+
+
+def load_plan(plan_path):
+    plan_path = Path(plan_path)
+    if plan_path.suffix.lower() == ".csv":
+        with open(plan_path, "r", encoding="utf-8", newline="") as f:
+            return [row | {"group": int(row["group"])} for row in csv.DictReader(f)]
+    with open(plan_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Trash:
+    """
+    Folder where the deleted files are moved, keeping their path relative to the root folder, so that they can be restored.
+    Each move is recorded in a json lines log inside the folder.
+    """
+
+    def __init__(self, trash_dir, root_folder=None):
+        self.trash_dir = Path(trash_dir)
+        self.root_folder = Path(root_folder) if root_folder is not None else None
+        self.log_path = self.trash_dir / TRASH_LOG
+
+    def _trash_path(self, file_path):
+        file_path = Path(file_path).resolve()
+        if self.root_folder is not None and file_path.is_relative_to(self.root_folder.resolve()):
+            relative = file_path.relative_to(self.root_folder.resolve())
+        else:
+            relative = file_path.relative_to(file_path.anchor)
+        trash_path = self.trash_dir / relative
+        i = 1
+        while trash_path.exists():
+            trash_path = trash_path.with_name(f"{relative.stem} ({i}){relative.suffix}")
+            i += 1
+        return trash_path
+
+    def move(self, file_path):
+        """
+        Move a file to the trash and return its new path.
+        """
+        trash_path = self._trash_path(file_path)
+        trash_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(file_path, trash_path)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"original": str(Path(file_path).resolve()), "trashed": str(trash_path),
+                "time": datetime.datetime.now().isoformat(timespec="seconds")}, ensure_ascii=False) + "\n")
+        return trash_path
+
+    def restore_all(self):
+        """
+        Move all the files in the trash back to their original path, if it is free.
+        Return the list of the files that could not be restored.
+        """
+        if not self.log_path.is_file():
+            return []
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        not_restored = []
+        for entry in entries:
+            original, trashed = Path(entry["original"]), Path(entry["trashed"])
+            if not trashed.exists() or original.exists():
+                not_restored.append(entry)
+                continue
+            original.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(trashed, original)
+        # keep in the log only the entries that are still in the trash
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            for entry in not_restored:
+                if Path(entry["trashed"]).exists():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return [e["original"] for e in not_restored]
+
+
+def apply_plan(rows, trash):
+    """
+    Move to the trash the files marked for deletion.
+    The files of a group are deleted only if the file to keep still exists, files that no longer exist are skipped.
+    Return a tuple (number of deleted files, freed bytes).
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["group"], []).append(row)
+    deleted = 0
+    freed = 0
+    for group_id, group_rows in groups.items():
+        keep = [r["file"] for r in group_rows if r["action"] == "keep"]
+        if len(keep) != 1 or not os.path.isfile(keep[0]):
+            print(f"Group {group_id}: the file to keep is missing, skipping")
+            continue
+        for r in group_rows:
+            if r["action"] != "delete":
+                continue
+            if not os.path.isfile(r["file"]):
+                print(f"Group {group_id}: {r['file']} no longer exists, skipping")
+                continue
+            size = os.path.getsize(r["file"])
+            trash.move(r["file"])
+            deleted += 1
+            freed += size
+    return deleted, freed
@@ -1,43 +1,131 @@
+import argparse
+import os
+import shutil
 from pathlib import Path
-from mutagen.mp4 import MP4
 
-def ask_12_question(question):
+from openscripts.io.file_utils import human_readable
+from openscripts.io.probe_cache import ProbeCache
+from duplicate_engine import DuplicateFinder, MATCH_MODES
+from acoustic_fingerprint import FingerprintIndex, fingerprint_file, MAX_BER
+from duplicate_resolution import POLICIES, Trash, read_audio_infos, durations_agree, choose_file_to_keep, build_plan, write_plan, load_plan, apply_plan
+
+DEFAULT_TRASH_FOLDER = ".duplicates_trash"
+MAX_DURATION_DIFFERENCE = 60 # seconds
+
+def ask_choice_question(question, n_choices):
+    choices = [str(i + 1) for i in range(n_choices)]
     input_file = ""
-    while not input_file in ["1", "2"]:
+    while not input_file in choices:
         input_file = input(question)
-    return input_file
+    return int(input_file) - 1
+
+def format_info(info):
+    bitrate = f"{info['bitrate']} kbps" if info["bitrate"] is not None else "? kbps"
+    duration = f"{info['duration'] / 60:.1f} min" if info["duration"] is not None else "? min"
+    return f"{bitrate}, {duration}"
 
-def get_audio_rate(filename):
-    return str(round(MP4(filename).info.bitrate / 1000)) + " kbps"
+def list_files(target_folder, extensions, skip_folders=()):
+    # files with one of the given extensions at any depth
+    skip_folders = {os.path.abspath(f) for f in skip_folders}
+    for root, folders, files in os.walk(target_folder):
+        folders[:] = [d for d in folders if os.path.abspath(os.path.join(root, d)) not in skip_folders]
+        for name in files:
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield Path(root) / name
 
 def main():
-    target_folder = input("Enter the target folder:\n")
+    parser = argparse.ArgumentParser(description='Find and remove duplicated audio files')
+    parser.add_argument('--target-folder', '-tf', help='Folder to scan (at any depth)', type=str)
+    parser.add_argument('--match', '-m', help='How duplicates are detected: same audio data ignoring the tags, same content, same name or same sound (acoustic fingerprint)', choices=MATCH_MODES, default="audio")
+    parser.add_argument('--extensions', '-e', help='Comma separated list of the extensions of the files to compare', type=str, default="m4a")
+    parser.add_argument('--workers', '-w', help='Number of files hashed at the same time', type=int, default=8)
+    parser.add_argument('--hash-cache', '-hc', help='Optional sqlite file where the hashes and the audio info are saved, so that unchanged files are not read again', type=str)
+    parser.add_argument('--fingerprint-index', '-fi', help='Optional sqlite file where the acoustic fingerprints are saved, used with --match fingerprint and --check', type=str)
+    parser.add_argument('--max-ber', help='Maximum bit error rate of the fingerprints of two matching files (0-0.5). Values above ~0.25 find few more files, '
+        'since the index finds only files that share several exact bands of bits', type=float, default=MAX_BER)
+    parser.add_argument('--max-duration-diff', help='With --match fingerprint, the groups whose durations differ more than these seconds are not resolved automatically '
+        '(the fingerprint covers only the beginning of the files, that may be a shared intro)', type=float, default=MAX_DURATION_DIFFERENCE)
+    parser.add_argument('--check', help='Search a file in the fingerprint index and exit (e.g. a new download)', type=str)
+    parser.add_argument('--policy', '-p', help='How the file to keep is chosen', choices=POLICIES, default="interactive")
+    parser.add_argument('--prefer-folder', '-pf', help='Preferred folder for the folder policy, can be repeated in order of preference', type=str, action='append', default=[])
+    parser.add_argument('--plan', help='Save the plan (json, or csv if the extension is .csv) to review it instead of deleting the files', type=str)
+    parser.add_argument('--apply', help='Apply a saved plan, without scanning again', type=str)
+    parser.add_argument('--trash-dir', '-td', help=f'Folder where the deleted files are moved (by default {DEFAULT_TRASH_FOLDER} in the target folder)', type=str)
+    parser.add_argument('--undo', help='Restore all the files in the trash folder to their original path', action='store_true')
+    args = parser.parse_args()
+    if args.policy == "folder" and not args.prefer_folder:
+        parser.error("--prefer-folder is required with the folder policy")
+    if args.check and not args.fingerprint_index:
+        parser.error("--fingerprint-index is required with --check")
+    if (args.match == "fingerprint" or args.check) and shutil.which("ffmpeg") is None:
+        print("WARNING: ffmpeg not found, only wav files can be fingerprinted")
+
+    if args.check:
+        with FingerprintIndex(args.fingerprint_index) as index:
+            matches = index.query(fingerprint_file(args.check), max_ber=args.max_ber, exclude=args.check)
+        print(f"Found {len(matches)} matching files")
+        [print(f"\t[bit error rate {ber:.3f}, offset {offset:+.1f} s] {path}") for path, ber, offset in matches]
+        return
+
+    target_folder = args.target_folder
+    if target_folder is None:
+        target_folder = input("Enter the target folder:\n")
     target_folder = Path(target_folder)
+    trash = Trash(args.trash_dir or target_folder / DEFAULT_TRASH_FOLDER, root_folder=target_folder)
 
-    files = target_folder.glob("*/*.m4a")
-    seen = {}
+    if args.undo:
+        not_restored = trash.restore_all()
+        print(f"Restored the files in {trash.trash_dir}" + (f", {len(not_restored)} could not be restored:" if not_restored else ""))
+        [print(f"\t{f}") for f in not_restored]
+        return
+    if args.apply:
+        deleted, freed = apply_plan(load_plan(args.apply), trash)
+        print(f"Moved {deleted} files ({human_readable(freed)}) to {trash.trash_dir}")
+        return
 
-    for f in files:
-        if str(f.stem) in list(seen.keys()):
-            print("Found matching files:")
-            one = seen[str(f.stem)]
-            one_rate = get_audio_rate(target_folder / one)
-            two = str(f.relative_to(target_folder))
-            two_rate = get_audio_rate(target_folder / two)
-            print(f"\t1. [{one_rate}] {one}")
-            print(f"\t2. [{two_rate}] {two}")
-            res = ask_12_question("Choose the file to KEEP [1\\2]\n")
-            if res == "2":
-                seen[str(f.stem)] = str(f.relative_to(target_folder))
-                (target_folder / one).unlink()
-            else:
-                (target_folder / two).unlink()
-        else:
-            seen[str(f.stem)] = str(f.relative_to(target_folder))
+    extensions = {f".{e.strip().lstrip('.').lower()}" for e in args.extensions.split(",") if e.strip()}
+    files = list(list_files(target_folder, extensions, skip_folders=[trash.trash_dir]))
+    print(f"Found {len(files)} files, looking for duplicates (match: {args.match})")
+    cache = ProbeCache(args.hash_cache) if args.hash_cache else None
+    index = FingerprintIndex(args.fingerprint_index) if args.match == "fingerprint" and args.fingerprint_index else None
+    try:
+        finder = DuplicateFinder(mode=args.match, workers=args.workers, cache=cache, index=index, max_ber=args.max_ber)
+        groups = finder.find(files)
+        print(f"Found {len(groups)} groups of duplicates (hashed {finder.stats['computed']} times, {finder.stats['cached']} from cache)")
+        # bitrate and duration are read only once for each file
+        infos = read_audio_infos([f for group in groups for f in group], workers=args.workers, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+        if index is not None:
+            index.close()
 
+    if args.match == "fingerprint" and args.policy != "interactive":
+        # only groups of files with about the same duration are resolved, the others are left to a manual check
+        skipped = [g for g in groups if not durations_agree(g, infos, args.max_duration_diff)]
+        groups = [g for g in groups if durations_agree(g, infos, args.max_duration_diff)]
+        if skipped:
+            print(f"Skipping {len(skipped)} groups whose durations differ more than {args.max_duration_diff} s, check them with --policy interactive:")
+            [print(f"\t{', '.join(f'{f.relative_to(target_folder)} [{format_info(infos[f])}]' for f in g)}") for g in skipped]
 
+    keep_files = []
+    for group in groups:
+        if args.policy == "interactive":
+            print("Found matching files:")
+            for i, f in enumerate(group):
+                print(f"\t{i + 1}. [{format_info(infos[f])}] {f.relative_to(target_folder)}")
+            keep_files.append(group[ask_choice_question(f"Choose the file to KEEP [1-{len(group)}]\n", len(group))])
+        else:
+            keep_files.append(choose_file_to_keep(group, infos, args.policy, args.prefer_folder))
+    rows = build_plan(groups, keep_files, infos)
 
+    if args.plan:
+        write_plan(rows, args.plan)
+        print(f"Plan saved to {args.plan}, {len([r for r in rows if r['action'] == 'delete'])} files to delete. Apply it with --apply")
+        return
+    deleted, freed = apply_plan(rows, trash)
+    print(f"Moved {deleted} files ({human_readable(freed)}) to {trash.trash_dir}, restore them with --undo")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,96 @@
+import functools
+import re
+from collections import Counter
+
+BRACKETS_PATTERN = re.compile(r'\[.*\]')
+PARENTHESES_PATTERN = re.compile(r'\(.*\)')
+WORD_PATTERN = re.compile(r'\w+')
+REMOVE_CHARS = "-_–.,;': "
+
+# codepoints of the emoji (Extended_Pictographic property of the Unicode emoji data), the emoji package is not needed.
+# Only the pictographic codepoints of the symbol blocks are included, so that e.g. check marks, arrows and circled numbers are kept
+EMOJI_RANGES = [
+    (0x00A9, 0x00A9), (0x00AE, 0x00AE), (0x203C, 0x203C), (0x2049, 0x2049), (0x2122, 0x2122), (0x2139, 0x2139),
+    (0x2194, 0x2199), (0x21A9, 0x21AA), (0x231A, 0x231B), (0x2328, 0x2328), (0x2388, 0x2388), (0x23CF, 0x23CF),
+    (0x23E9, 0x23F3), (0x23F8, 0x23FA), (0x24C2, 0x24C2), (0x25AA, 0x25AB), (0x25B6, 0x25B6), (0x25C0, 0x25C0),
+    (0x25FB, 0x25FE), (0x2600, 0x2605), (0x2607, 0x2612), (0x2614, 0x2685), (0x2690, 0x2705), (0x2708, 0x2712),
+    (0x2714, 0x2714), (0x2716, 0x2716), (0x271D, 0x271D), (0x2721, 0x2721), (0x2728, 0x2728), (0x2733, 0x2734),
+    (0x2744, 0x2744), (0x2747, 0x2747), (0x274C, 0x274C), (0x274E, 0x274E), (0x2753, 0x2755), (0x2757, 0x2757),
+    (0x2763, 0x2767), (0x2795, 0x2797), (0x27A1, 0x27A1), (0x27B0, 0x27B0), (0x27BF, 0x27BF), (0x2934, 0x2935),
+    (0x2B05, 0x2B07), (0x2B1B, 0x2B1C), (0x2B50, 0x2B50), (0x2B55, 0x2B55), (0x3030, 0x3030), (0x303D, 0x303D),
+    (0x3297, 0x3297), (0x3299, 0x3299),
+    (0x1F000, 0x1F0FF), (0x1F10D, 0x1F10F), (0x1F12F, 0x1F12F), (0x1F16C, 0x1F171), (0x1F17E, 0x1F17F), (0x1F18E, 0x1F18E),
+    (0x1F191, 0x1F19A), (0x1F1AD, 0x1F1E5), (0x1F201, 0x1F20F), (0x1F21A, 0x1F21A), (0x1F22F, 0x1F22F), (0x1F232, 0x1F23A),
+    (0x1F23C, 0x1F23F), (0x1F249, 0x1F3FA), (0x1F400, 0x1F53D), (0x1F546, 0x1F64F), (0x1F680, 0x1F6FF), (0x1F774, 0x1F77F),
+    (0x1F7D5, 0x1F7FF), (0x1F80C, 0x1F80F), (0x1F848, 0x1F84F), (0x1F85A, 0x1F85F), (0x1F888, 0x1F88F), (0x1F8AE, 0x1F8FF),
+    (0x1F90C, 0x1F93A), (0x1F93C, 0x1F945), (0x1F947, 0x1FAFF), (0x1FC00, 0x1FFFD),
+]
+# characters that are emoji only as part of a sequence: variation selectors, keycap, skin tones, regional indicators (flags)
+# and tags (e.g. of the subdivision flags)
+EMOJI_MODIFIER_RANGES = [(0xFE0E, 0xFE0F), (0x20E3, 0x20E3), (0x1F3FB, 0x1F3FF), (0x1F1E6, 0x1F1FF), (0xE0020, 0xE007F)]
+_emoji_table = None
+_emoji_sequence_pattern = None
+
+def _get_emoji_tables():
+    # built on the first use: a translate table for the single codepoints and a regex for the sequences
+    global _emoji_table, _emoji_sequence_pattern
+    if _emoji_table is None:
+        _emoji_table = dict.fromkeys((c for start, end in EMOJI_RANGES + EMOJI_MODIFIER_RANGES for c in range(start, end + 1)), None)
+        emoji_class = "".join(f"{re.escape(chr(start))}-{re.escape(chr(end))}" for start, end in EMOJI_RANGES)
+        modifier_class = "".join(f"{re.escape(chr(start))}-{re.escape(chr(end))}" for start, end in EMOJI_MODIFIER_RANGES)
+        # keycaps (e.g. 1️⃣) start with a normal character and zwj sequences (e.g. 👨‍👩‍👧) are joined by zero width joiners,
+        # that must be removed only inside emoji since they are used also by some scripts
+        _emoji_sequence_pattern = re.compile(
+            rf"[0-9#*]\ufe0f?\u20e3|[{emoji_class}][{modifier_class}]*(?:\u200d[{emoji_class}][{modifier_class}]*)+"
+        )
+    return _emoji_table, _emoji_sequence_pattern
+
+def de_emojify(text):
+    if text.isascii():
+        return text
+    table, sequence_pattern = _get_emoji_tables()
+    return sequence_pattern.sub('', text).translate(table)
+
+def clean_text(text):
+    text = BRACKETS_PATTERN.sub('', text)
+    text = PARENTHESES_PATTERN.sub('', text)
+    text = text.replace("  ", " ")
+    return text.strip(REMOVE_CHARS).strip()
+
+
+class NameCleaner:
+    """
+    Remove the words of a name (e.g. of the author) from the beginning and the end of titles, in any order and case.
+    The words of the name are prepared once, then each title is cleaned in linear time in its length:
+    the first and the last words of the title are compared with the name as multisets, so the order does not matter,
+    and since the name is never used as a regex its special characters need no escaping.
+    """
+
+    def __init__(self, name):
+        # emoji and symbols are not part of the words, so they are ignored without removing them explicitly
+        words = [clean_text(w) for w in name.split(" ")]
+        self.words = Counter(t.casefold() for w in words for t in WORD_PATTERN.findall(w))
+        self.n_words = sum(self.words.values())
+
+    def _matches(self, words):
+        return Counter(w.group().casefold() for w in words) == self.words
+
+    def clean(self, title):
+        if self.n_words == 0:
+            return title
+        words = list(WORD_PATTERN.finditer(title))
+        start, end = 0, len(title)
+        # remove at the end
+        if len(words) >= self.n_words and self._matches(words[-self.n_words:]):
+            end = words[-self.n_words].start()
+            words = words[:-self.n_words]
+        # remove at the beginning
+        if len(words) >= self.n_words and self._matches(words[:self.n_words]):
+            start = words[self.n_words - 1].end()
+        return title[start:end]
+
+
+@functools.lru_cache(maxsize=256)
+def get_name_cleaner(name):
+    # the files of an album share author and album, so the cleaners are built once per name
+    return NameCleaner(name)
@@ -1,65 +1,52 @@
 from mutagen.mp4 import MP4
-import emoji
 from pathlib import Path
-import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
 import os
-import itertools
 import json
 
+from name_cleaner import de_emojify, clean_text, get_name_cleaner
+
+TITLE = "\xa9nam"
+ALBUM = "\xa9alb"
+ARTIST = "\xa9ART"
+MANIFEST_NAME = "output_retag.jsonl"
+
+def get_fields(filename, fields):
+    # read all the fields with a single parse of the file
+    tags = MP4(filename).tags or {}
+    return {field: tags.get(field, [None])[-1] for field in fields}
+
 def get_field(filename, field):
-    return MP4(filename).tags.get(field, [None])[-1]
+    return get_fields(filename, [field])[field]
+
+def set_fields(filename, values):
+    """
+    Set all the tags in values (dict field -> value) with a single parse and a single save of the file.
+    The file is not written at all if the tags already have the given values.
+    Return true if the file was modified.
+    """
+    audio = MP4(filename)
+    if audio.tags is None:
+        audio.add_tags()
+    changed = False
+    for field, value in values.items():
+        value = value if isinstance(value, list) else [value]
+        if audio.tags.get(field) != value:
+            audio.tags[field] = value
+            changed = True
+    if changed:
+        audio.save()
+    return changed
 
 def set_field(filename, field, value):
-    tags = MP4(filename).tags
-    tags[field] = value
-    tags.save(filename)
-
-def de_emojify(text):
-    return emoji.get_emoji_regexp().sub(r'', text)
-
-def clean_text(text):
-    text = re.sub(r'\[.*\]', '', text)
-    text = re.sub(r'\(.*\)', '', text)
-    text = text.replace("  ", " ")
-    remove_chars = ["-", "_", "–", ".", ",", ";", "'", ":", " "]
-    while len(text) > 0 and (text[0] in remove_chars or text[-1] in remove_chars):
-        for c in remove_chars:
-            text = text.strip(c)
-    return text.strip()
-
-def remove_all_permutations(chunks, full_string):
-    chunks = [de_emojify(s) for s in chunks]
-    chunks = [clean_text(s) for s in chunks]
-    perms = list(itertools.permutations(chunks))
-    for perm in perms:
-        all_lower = " ".join(perm)
-        # note: do not use strip(), it matches also partial strings
-        full_string = re.sub(f'{all_lower}$', '', full_string) # remove at the end
-        full_string = re.sub(f'^{all_lower}', '', full_string) # remove at the beginning
-            
-
-        first_upper = [s[0].upper() + s[1:] if len(s) > 1 else s.upper() for s in perm]
-        # there are more permutations than necessary, but names and albums are usually made up of a few (<10) words so it should be fine
-        for i in range(len(perm)):
-            perm_t = list(perm).copy()
-            perm_t[i] = first_upper[i]
-            my_string = " ".join(perm_t)
-            full_string = re.sub(f'{my_string}$', '', full_string) # remove at the end
-            full_string = re.sub(f'^{my_string}', '', full_string) # remove at the beginning
-            for j in range(len(perm)):
-                perm_t[j] = first_upper[j]
-                my_string = " ".join(perm_t)
-                full_string = re.sub(f'{my_string}$', '', full_string)
-                full_string = re.sub(f'^{my_string}', '', full_string)
-    return full_string
+    return set_fields(filename, {field: value})
 
 def author_album_clean(author, album, filename):
     new_filename = de_emojify(filename)
     new_filename = clean_text(new_filename)
-    author_chunks = author.lower().split(" ")
-    new_filename = remove_all_permutations(author_chunks, new_filename)
-    album_chunks = album.lower().split(" ")
-    new_filename = remove_all_permutations(album_chunks, new_filename)
+    new_filename = get_name_cleaner(author).clean(new_filename)
+    new_filename = get_name_cleaner(album).clean(new_filename)
     new_filename = de_emojify(new_filename)
     new_filename = clean_text(new_filename)
     return new_filename
@@ -71,56 +58,101 @@ def ask_yn_question(question):
     input_file = (input_file in ["y", "Y"]) # transform to bool
     return input_file
 
-def main():
+def list_files(target_folder):
     # folders must be organized in this form:
     # TARGET_FOLDER / AUTHOR_NAME / ALBUM_NAME / *.m4a
-    
-    # ask for the folder
-    target_folder = input("Enter the target folder:\n")
-    sanitize_names = ask_yn_question("Do you want to sanitize the filenames and titles (remove emoji etc)? [y/n] ")
-    output_file = Path(target_folder) / "output_retag.json"
-    output_list = []
-    
-    authors = Path(target_folder).glob("*")
-    for author_folder in authors:
-        author_name = author_folder.stem
-        print(f"Parsing author: {author_name}")
-        for album_folder in author_folder.glob("*"):
-            album_name = album_folder.stem
-            print(f"\tParsing album: {album_name}")
-            for filename in album_folder.glob("*.m4a"):
-                title = filename.stem # some edits should be done here
-                print(f"\t\tParsing file: {title}")
-                if sanitize_names:
-                    title = de_emojify(title)
-                    title = clean_text(title)
-                    title = author_album_clean(author_name, album_name, title)
-                    if len(title) == 0:
-                        title = album_name
-                
-                set_field(filename.resolve(), "\xa9nam", title) # title
-                set_field(filename.resolve(), "\xa9alb", album_name) # album
-                set_field(filename.resolve(), "\xa9ART", author_name) # artist
-                print(f"\t\t\tOutput is: TITLE: {title}, AUTHOR: {author_name}, ALBUM: {album_name}")
-                new_filename = title
-                counter = 1
-                # avoid conflicts
-                if not new_filename == filename.stem:
-                    while (filename.parent / (new_filename + filename.suffix)).exists():
-                        new_filename = new_filename + f"_{counter}"
-                        counter +=1
-                    filename.rename(filename.parent / (new_filename + filename.suffix))
-
-                output_list.append({
-                    "file_path" : str(filename.relative_to(Path(target_folder))),
-                    "new_filename" : new_filename,
-                    "author" : author_name,
-                    "album" : album_name,
-                    "title" : title
-                })
-    
-    with open(output_file, 'a', encoding='utf-8') as f:
-        json.dump(output_list, f, ensure_ascii=False, indent=4)
+    for author_folder in sorted(Path(target_folder).iterdir()):
+        if not author_folder.is_dir():
+            continue
+        for album_folder in sorted(author_folder.iterdir()):
+            if album_folder.is_dir():
+                for filename in sorted(album_folder.glob("*.m4a")):
+                    yield author_folder.stem, album_folder.stem, filename
+
+def load_manifest(manifest_file):
+    # return the set of the paths (relative to the target folder, after the rename) of the files that were already processed
+    done = set()
+    if not os.path.isfile(manifest_file):
+        return done
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # e.g. the last line of a run that was interrupted while writing
+                continue
+            if not record.get("error"):
+                done.add(record["new_file_path"])
+    return done
+
+def retag_file(filename, author_name, album_name, sanitize_names):
+    """
+    Compute the title of a file and write its tags, run in a worker process.
+    Return a tuple (title, true if the tags were changed).
+    """
+    title = filename.stem # some edits should be done here
+    if sanitize_names:
+        title = de_emojify(title)
+        title = clean_text(title)
+        title = author_album_clean(author_name, album_name, title)
+        if len(title) == 0:
+            title = album_name
+    changed = set_fields(filename.resolve(), {TITLE: title, ALBUM: album_name, ARTIST: author_name})
+    return title, changed
+
+def rename_to_title(filename, title):
+    # rename the file to its title, avoiding conflicts with the existing files, and return the new name (without extension)
+    new_filename = title
+    counter = 1
+    if not new_filename == filename.stem:
+        while (filename.parent / (new_filename + filename.suffix)).exists():
+            new_filename = new_filename + f"_{counter}"
+            counter +=1
+        filename.rename(filename.parent / (new_filename + filename.suffix))
+    return new_filename
+
+def main():
+    parser = argparse.ArgumentParser(description='Set the tags of audio files from their path: TARGET_FOLDER / AUTHOR_NAME / ALBUM_NAME / *.m4a')
+    parser.add_argument('--target-folder', '-tf', help='Folder with the authors', type=str)
+    parser.add_argument('--sanitize', '-s', help='Sanitize the filenames and titles (remove emoji etc)', action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument('--workers', '-w', help='Number of files processed at the same time', type=int, default=os.cpu_count())
+    parser.add_argument('--restart', help=f'Process again also the files already in the manifest ({MANIFEST_NAME})', action='store_true')
+    args = parser.parse_args()
+
+    # ask for the missing options
+    target_folder = args.target_folder
+    if target_folder is None:
+        target_folder = input("Enter the target folder:\n")
+    sanitize_names = args.sanitize
+    if sanitize_names is None:
+        sanitize_names = ask_yn_question("Do you want to sanitize the filenames and titles (remove emoji etc)? [y/n] ")
+    target_folder = Path(target_folder)
+    manifest_file = target_folder / MANIFEST_NAME
+
+    # resume from the manifest: the files already processed have their final name
+    done = set() if args.restart else load_manifest(manifest_file)
+    jobs = [(author, album, f) for author, album, f in list_files(target_folder) if str(f.relative_to(target_folder)) not in done]
+    if done:
+        print(f"Skipping {len(done)} files already in {manifest_file}")
+    print(f"Processing {len(jobs)} files")
+
+    # one json line is written as soon as each file is done, so an interrupted run can be resumed
+    # renames are done in this process, so that files of the same album never compete for the same name
+    with open(manifest_file, 'a', encoding='utf-8', buffering=1) as manifest, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(retag_file, f, author, album, sanitize_names): (author, album, f) for author, album, f in jobs}
+        for future in as_completed(futures):
+            author_name, album_name, filename = futures[future]
+            record = {"file_path": str(filename.relative_to(target_folder)), "author": author_name, "album": album_name}
+            try:
+                title, changed = future.result()
+                new_filename = rename_to_title(filename, title)
+                record |= {"new_filename": new_filename, "new_file_path": str((filename.parent / (new_filename + filename.suffix)).relative_to(target_folder)),
+                    "title": title, "tags_changed": changed}
+                print(f"{record['file_path']}\n\tOutput is: TITLE: {title}, AUTHOR: {author_name}, ALBUM: {album_name}" + ("" if changed else " (tags already set)"))
+            except Exception as e:
+                record["error"] = str(e)
+                print(f"{record['file_path']}\n\tERROR: {e}")
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,5 @@
 from pathlib import Path
+import itertools
 import os
 import shutil
 import re
@@ -13,6 +14,9 @@ OUTPUT_COMPLETE = "COMPLETE"
 OUTPUT_ONGOING = "ONGOING"
 # folders to exclude during the search (they are excluded at all levels, so paths are not supported)
 SKIP_FOLDERS = ["!Completed", "!EPUB", "!PDF"]
+# tags are the strings between square brackets, the simple name of a file is everything before the first tag
+TAG_PATTERN = re.compile(r'\[(.*?)]')
+SIMPLE_NAME_PATTERN = re.compile(r'[^\[]*')
 
 def main(target_folder, mode, filters_file):
     """
@@ -32,25 +36,20 @@ def main(target_folder, mode, filters_file):
     output_ongoing_folder = os.path.join(parent_folder, OUTPUT_FOLDER, OUTPUT_ONGOING)
     Path(output_complete_folder).mkdir(parents=True, exist_ok=True)
     Path(output_ongoing_folder).mkdir(parents=True, exist_ok=True)
-    # walk through all subfolders and skip the main one (target_folder itself)
-    subfolders = [x[0] for x in os.walk(target_folder)][1:]
-    # remove excluded folders
-    subfolders = [s for s in subfolders if not os.path.basename(s) in SKIP_FOLDERS]
     counter = 1
-    # get list of tags in order of importance
-    filters = get_all_filters(filters_file)
+    # get list of tags in order of importance and their ranks
+    filter_ranks = get_filter_ranks(get_all_filters(filters_file))
 
     print("\n\tPROCESSING...\n")
-    for s in subfolders:
-        # full path
-        full_s = s
+    # the folders are processed while the walk goes on, so their total number is not known
+    for full_s, files in walk_folders(target_folder):
         # relative path
         s = os.path.relpath(full_s, target_folder)
-        print_statusline(f"[{counter}/{len(subfolders)}] : {s}")
+        print_statusline(f"[{counter}] : {s}")
         counter = counter+1
         
         # compare equal files (i.e. same book) and get the best according to their tags
-        best_matches = get_best_files(full_s, filters)
+        best_matches = get_best_files(files, filter_ranks)
         # choose output folder according to the list of completed series
         # note: use first part of relative path (i.e. main folder of the serie) or all the subfolders (e.g. side stories) will fail the comparison
         main_s = s.split(os.path.sep)[0]
@@ -96,20 +95,39 @@ def get_complete_list(target_folder):
         completed_series = completed_series.splitlines()
     return completed_series
 
+def walk_folders(target_folder):
+    """
+    Yield a tuple (folder, list of file names) for each subfolder of target_folder at any depth (not target_folder itself),
+    folders are yielded as soon as they are listed. Folders in SKIP_FOLDERS are not entered.
+    Each folder is listed only once with os.scandir, whose entries already know their type, so no further stat is needed.
+    """
+    # skip the main one (target_folder itself)
+    return itertools.islice(_walk_folder(target_folder), 1, None)
+
+def _walk_folder(folder):
+    try:
+        with os.scandir(folder) as it:
+            entries = list(it)
+    except OSError:
+        # unreadable folder, skip it as os.walk does
+        return
+    yield folder, [e.name for e in entries if e.is_file()]
+    for e in entries:
+        # symlinks to folders are not followed, as in os.walk
+        if e.is_dir(follow_symlinks=False) and e.name not in SKIP_FOLDERS:
+            yield from _walk_folder(e.path)
+
 def get_tags(s):
     # get tags in a filename using regex. 
     # Includes all strings between square brackets and file extension.
     all_tags = [Path(s).suffix]
-    all_tags.extend(re.findall(r'\[(.*?)]', s))
+    all_tags.extend(TAG_PATTERN.findall(s))
     return all_tags
 
 def export_all_tags(target_folder, export_file):
     # save a list with all the tags included in all files, to help in the creation of the filters_file
-    subfolders = [x[0] for x in os.walk(target_folder)][1:]
-    subfolders = [s for s in subfolders if not os.path.basename(s) in SKIP_FOLDERS]
     tags = set()
-    for s in subfolders:
-        files = [f for f in os.listdir(s) if os.path.isfile(os.path.join(s, f))]
+    for _, files in walk_folders(target_folder):
         for f in files:
             for t in get_tags(f):
                 tags.add(t)
@@ -117,64 +135,46 @@ def export_all_tags(target_folder, export_file):
     with open(export_file, 'w') as f:
         f.write('\n'.join(tags))
 
-def get_best_files(folder, filters):
+def get_best_files(files, filter_ranks):
     """
     Compare all files in a folder that differ only by tags (and extension) and return only the best one according to their tags.
-    If filters is None, return all files.
-        folder: folder containing the files to check
-        filters: list of filters in order of importance
+    If filter_ranks is None, return all files.
+        files: names of the files in the folder, as yielded by walk_folders
+        filter_ranks: dict tag -> rank (0 is the most important), see get_filter_ranks
     """
-    # list all the files
-    files = [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
     files = [Path(f) for f in files]
     files = sorted(files)
-    paired_names = [] # contains tuples in the form: (simple_name, [(file_name, [tag1, tag2, ..., tagN])])
+    paired_names = {} # simple_name -> [file_name1, file_name2, ...], in the order of files
     for f in files:
-        # get the simple filename, i.e. without extension and tags
-        simple_name = re.findall(r"([^\[]*)", f.name)[0]
-        # check if there is an entry with the same name
-        found = False
-        for tp in paired_names:
-            if tp[0] == simple_name:
-                # if yes, add to the list of files with the same simple name (i.e. the same book)
-                tp[1].append((f, get_tags(f.name)))
-                found = True
-                break
-        if not found:
-            # no other file has the same name, add as a new entry
-            current_tuple = (simple_name, [(f, get_tags(f.name))])
-            paired_names.append(current_tuple)
-    # loop paired_names, check for each simple name, which full name has the highest tag (if equal check second etc.) 
-    # and get the best for each simple name, return all such full names
-    best_matches = []
-    for pn in paired_names:
-        _, common_files = pn
-        if filters is not None:
-            # set first entry as the best one
-            current_best = common_files[0][0]
-            current_tags = common_files[0][1]
-            # loop through all the others
-            for file, tags in common_files[1:]:
-                if has_better_tags(current_tags, tags, filters):
-                    current_best = file
-                    current_tags = tags
-            best_matches.append(current_best)
-        else:
-            # add all
-            for file, _ in common_files:
-                best_matches.append(file)
-    return best_matches
+        # get the simple filename, i.e. without extension and tags, files with the same simple name are the same book
+        simple_name = SIMPLE_NAME_PATTERN.match(f.name).group()
+        paired_names.setdefault(simple_name, []).append(f)
+    if filter_ranks is None:
+        # add all
+        return [file for common_files in paired_names.values() for file in common_files]
+    # for each simple name get the file with the best tags, min returns the first one if more files are equal
+    return [min(common_files, key=lambda f: get_tags_key(get_tags(f.name), filter_ranks)) for common_files in paired_names.values()]
 
-def has_better_tags(source_tags, new_tags, filters):
-    # true if new_tags are better than source_tags
+def get_tags_key(tags, filter_ranks):
+    """
+    Sortable key of a list of tags, the lower the better: the ranks of the tags included in the filters, in increasing order, followed by
+    the number of filters. Comparing two keys gives the same result as comparing the tags filter by filter, i.e. the first filter
+    that only one of the files has decides which file is better, the closing number makes a file with an extra tag better.
+    """
+    ranks = sorted({filter_ranks[t] for t in tags if t in filter_ranks})
+    ranks.append(len(filter_ranks))
+    return ranks
+
+def get_filter_ranks(filters):
+    # map each tag to its position in the list of filters, built once for all folders
+    if filters is None:
+        return None
+    filter_ranks = {}
     for f in filters:
-        if f in source_tags and f not in new_tags:
-            return False # source has one better tag
-        elif f not in source_tags and f in new_tags:
-            return True # new has one better tag
-        # else continue if both have the same tag or none has it
-    return False # files are equal (either they have the same tags or their different tags are not included in the filters), keep the source
-    
+        # a repeated tag keeps its most important position
+        filter_ranks.setdefault(f, len(filter_ranks))
+    return filter_ranks
+
 def get_all_filters(filters_file):
     # get list with all tags ordered by importance
     if filters_file is None:
@@ -0,0 +1,145 @@
+import click
+import contextlib
+import io
+import json
+import os
+import random
+import stat
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from openscripts.media.video.mkv_utils import MkvFile
+from video_audio_sub_processor import ProcessingOptions, build_plan, probe_files, probe_sub_sizes, needs_sub_sizes
+from processing_report import ProcessingReport
+
+# Benchmark of the planning overhead of video_audio_sub_processor without real media files.
+# mkvmerge and mediainfo are replaced by stub executables that print synthetic json,
+# so the probing benchmark measures only the cost of spawning the processes and parsing their output.
+
+LANGUAGES = ["eng", "jpn", "ita", "spa", "fre", "ger", "und"]
+
+STUB_MKVMERGE = """#!{python}
+import json, sys
+with open(sys.argv[-1] + ".json") as f:
+    print(f.read())
+"""
+
+STUB_MEDIAINFO = """#!{python}
+import json, sys
+with open(sys.argv[-1] + ".json") as f:
+    data = json.load(f)
+tracks = [{{"@type": "Text", "UniqueID": str(tr["properties"]["uid"]), "StreamSize": str(tr["properties"]["uid"] % 997)}} for tr in data["tracks"] if tr["type"] == "subtitles"]
+print(json.dumps({{"media": {{"track": tracks}}}}))
+"""
+
+
+def make_track_json(rng, n_audio, n_subs):
+    tracks = [{"id": 0, "type": "video", "properties": {"uid": rng.getrandbits(48)}}]
+    for i in range(n_audio + n_subs):
+        tracks.append({
+            "id": i + 1,
+            "type": "audio" if i < n_audio else "subtitles",
+            "properties": {
+                "uid": rng.getrandbits(48),
+                "language": rng.choice(LANGUAGES),
+                "default_track": rng.random() < 0.3,
+                "forced_track": rng.random() < 0.1,
+            }
+        })
+    return {"tracks": tracks}
+
+
+def make_fixtures(folder, n_files, n_audio, n_subs, file_size, seed=0):
+    """
+    Create n_files fake mkv files of file_size bytes, each with a sidecar json read by the stub binaries.
+    """
+    rng = random.Random(seed)
+    files = []
+    for i in range(n_files):
+        target_file = folder / f"episode_{i:05d}.mkv"
+        with open(target_file, "wb") as f:
+            f.write(os.urandom(file_size))
+        with open(f"{target_file}.json", "w") as f:
+            json.dump(make_track_json(rng, n_audio, n_subs), f)
+        files.append(target_file)
+    return files
+
+
+def make_stubs(folder):
+    for name, template in [("mkvmerge", STUB_MKVMERGE), ("mediainfo", STUB_MEDIAINFO)]:
+        stub = folder / name
+        stub.write_text(template.format(python=sys.executable))
+        stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+
+
+def benchmark_planner(files_json, options, repeat):
+    # pure in-process planning: parse + build the plan, no subprocess
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for i, json_data in enumerate(files_json):
+                build_plan(Path(f"episode_{i}.mkv"), MkvFile.from_json(json_data), options)
+    return (time.perf_counter() - start_time) / (repeat * len(files_json))
+
+
+def benchmark_probing(files, options, workers):
+    report = ProcessingReport()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        files_info = probe_files(files, workers=workers, report=report)
+        files_needing_sizes = [f for f in files if files_info.get(f) is not None and needs_sub_sizes(files_info[f], options)]
+        probe_sub_sizes(files_needing_sizes, files_info, workers=workers, report=report)
+    return time.perf_counter() - start_time, report
+
+
+@click.command()
+@click.option("--files", "n_files", type=int, default=200, help="Number of synthetic files")
+@click.option("--audio-tracks", type=int, default=3)
+@click.option("--sub-tracks", type=int, default=8)
+@click.option("--file-size", type=int, default=4096, help="Size in bytes of each synthetic file")
+@click.option("--workers", type=int, multiple=True, default=[1, 4, 8], help="Probe workers to test, can be repeated")
+@click.option("--repeat", type=int, default=20, help="Repetitions of the in-process planner benchmark")
+@click.option("--output", type=str, help="Save the results as json")
+def main(n_files, audio_tracks, sub_tracks, file_size, workers, repeat, output):
+    options = ProcessingOptions(
+        language_audio_blacklist=("eng",),
+        language_audio_whitelist=(),
+        default_audio_lang="jpn",
+        default_sub_lang="ita",
+        disable_sub_processing=False,
+        sub_choice_selector="max_size",
+    )
+    results = {"files": n_files, "audio_tracks": audio_tracks, "sub_tracks": sub_tracks, "probing": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        bin_dir = tmp_dir / "bin"
+        data_dir = tmp_dir / "data"
+        bin_dir.mkdir()
+        data_dir.mkdir()
+        make_stubs(bin_dir)
+        files = make_fixtures(data_dir, n_files, audio_tracks, sub_tracks, file_size)
+        os.environ["PATH"] = str(bin_dir) + os.pathsep + os.environ.get("PATH", "")
+
+        files_json = [json.loads(Path(f"{f}.json").read_text()) for f in files]
+        per_file = benchmark_planner(files_json, options, repeat)
+        results["planner_us_per_file"] = round(per_file * 1e6, 3)
+        print(f"> Planner: {per_file * 1e6:.1f} us per file")
+
+        for w in workers:
+            elapsed, report = benchmark_probing(files, options, w)
+            summary = report.summary()
+            results["probing"][w] = {"wall_time": round(elapsed, 3), "files_per_second": round(n_files / elapsed, 1)} | summary
+            print(f"> Probing with {w} workers: {elapsed:.2f} s ({n_files / elapsed:.1f} files/s), "
+                f"mkvmerge {summary['mkvmerge_probe_time']:.2f} s, mediainfo {summary['mediainfo_probe_time']:.2f} s (sum over workers)")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    # usage e.g. python benchmark_video_processor.py --files 500 --workers 1 --workers 8
+    main()
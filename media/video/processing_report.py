@@ -0,0 +1,95 @@
+import csv
+import json
+from dataclasses import dataclass, asdict, fields
+from pathlib import Path
+
+from openscripts.io.file_utils import human_readable
+
+
+@dataclass
+class FileStats:
+    """
+    Timings (in seconds) and I/O of the processing of a single file.
+    """
+    file: str
+    size: int = 0
+    cached_probe: bool = False
+    mkvmerge_probe: float = 0.0
+    mediainfo_probe: float = 0.0
+    plan: float = 0.0
+    method: str = "" # mkvmerge, mkvpropedit or empty if the file was not modified
+    remux: float = 0.0
+    replace: float = 0.0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    error: str = ""
+
+    @property
+    def processing_time(self):
+        return self.remux + self.replace
+
+    @property
+    def throughput(self):
+        # MB/s of read + written data during the processing
+        if self.processing_time <= 0:
+            return 0.0
+        return (self.bytes_read + self.bytes_written) / self.processing_time / 1024 / 1024
+
+
+class ProcessingReport:
+
+    def __init__(self):
+        self.stats = {}
+
+    def get(self, target_file) -> FileStats:
+        key = str(target_file)
+        if key not in self.stats:
+            self.stats[key] = FileStats(file=key)
+        return self.stats[key]
+
+    def write(self, report_path):
+        """
+        Save the report as csv if the extension is .csv, as json otherwise.
+        """
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        rows = [asdict(s) | {"throughput": round(s.throughput, 3)} for s in self.stats.values()]
+        if report_path.suffix.lower() == ".csv":
+            with open(report_path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=[fl.name for fl in fields(FileStats)] + ["throughput"])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(report_path, "w", encoding="utf-8") as f:
+                json.dump({"files": rows, "summary": self.summary()}, f, ensure_ascii=False, indent=4)
+
+    def summary(self):
+        stats = list(self.stats.values())
+        processed = [s for s in stats if s.method]
+        processing_time = sum(s.processing_time for s in processed)
+        bytes_total = sum(s.bytes_read + s.bytes_written for s in processed)
+        return {
+            "files": len(stats),
+            "cached_probes": len([s for s in stats if s.cached_probe]),
+            "remuxed": len([s for s in processed if s.method == "mkvmerge"]),
+            "edited_in_place": len([s for s in processed if s.method == "mkvpropedit"]),
+            "errors": len([s for s in stats if s.error]),
+            "mkvmerge_probe_time": round(sum(s.mkvmerge_probe for s in stats), 3),
+            "mediainfo_probe_time": round(sum(s.mediainfo_probe for s in stats), 3),
+            "plan_time": round(sum(s.plan for s in stats), 3),
+            "remux_time": round(sum(s.remux for s in processed), 3),
+            "replace_time": round(sum(s.replace for s in processed), 3),
+            "bytes_read": sum(s.bytes_read for s in processed),
+            "bytes_written": sum(s.bytes_written for s in processed),
+            "throughput": round(bytes_total / processing_time / 1024 / 1024, 3) if processing_time > 0 else 0.0,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print("> Summary")
+        print(f">> Files: {summary['files']} (probes from cache: {summary['cached_probes']}, errors: {summary['errors']})")
+        print(f">> Remuxed: {summary['remuxed']}, edited in place: {summary['edited_in_place']}")
+        print(f">> Probing time (sum over workers): mkvmerge {summary['mkvmerge_probe_time']:.2f} s, mediainfo {summary['mediainfo_probe_time']:.2f} s")
+        print(f">> Planning time: {summary['plan_time']:.2f} s")
+        print(f">> Processing time (sum over workers): remux {summary['remux_time']:.2f} s, replace {summary['replace_time']:.2f} s")
+        print(f">> Data: read {human_readable(summary['bytes_read'])}, written {human_readable(summary['bytes_written'])}, {summary['throughput']:.2f} MB/s")
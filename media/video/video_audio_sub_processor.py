@@ -1,21 +1,19 @@
 import click
 import json
+import os
+import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from openscripts.io import process_utils
-from openscripts.media.video.mkv_utils import (
-    get_default_subs,
-    get_forced_subs,
-    get_audio_tracks,
-    get_subtitle_tracks,
-    get_tracks_to_keep_by_lang,
-    get_track_language,
-    get_ietf_track_language
-)
-from openscripts.io.file_utils import human_readable
-
-# TODO: make a proper wrapper for all fields returned by mkvmerge
+from openscripts.io.async_process_utils import run_commands
+from openscripts.media.video.mkv_utils import MkvFile, Track, filter_tracks_by_lang
+from openscripts.io.probe_cache import ProbeCache
+from openscripts.io.file_utils import human_readable, make_temp_file, atomic_replace, is_same_filesystem
+from processing_report import ProcessingReport
+
 # todo: add choice for sub based on tags (i.e. prefix of sub, or string contains)
 
 @click.command()
@@ -81,166 +79,413 @@ from openscripts.io.file_utils import human_readable
 )
 @click.option(
     "--tmp-folder",
-    type=str
+    type=str,
+    help="Folder where to write the remuxed files before replacing the originals (default: folder of each file). Use it for a fast scratch volume"
 )
 @click.option(
     "--auto-confirm",
     is_flag=True
 )
-def main(input_folder, include_subdirs, language_audio_blacklist, language_audio_whitelist, extensions_whitelist, default_audio_lang, default_sub_lang, disable_sub_processing, sub_choice_selector, dry_run, tmp_folder, auto_confirm):
+@click.option(
+    "--probe-workers",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="Number of files probed in parallel with mkvmerge/mediainfo"
+)
+@click.option(
+    "--remux-workers",
+    type=int,
+    default=1,
+    help="Number of files remuxed in parallel"
+)
+@click.option(
+    "--no-in-place-edit",
+    is_flag=True,
+    help="Always remux with mkvmerge, even when only the track flags must be changed (by default mkvpropedit is used in that case)"
+)
+@click.option(
+    "--report",
+    type=str,
+    help="Path where to save the timings of each file, as csv if the extension is .csv, as json otherwise"
+)
+@click.option(
+    "--probe-cache",
+    type=str,
+    help="Path to a sqlite file where to cache the probe results, so that unchanged files are not probed again"
+)
+def main(input_folder, include_subdirs, language_audio_blacklist, language_audio_whitelist, extensions_whitelist, default_audio_lang, default_sub_lang, disable_sub_processing, sub_choice_selector, dry_run, tmp_folder, auto_confirm, probe_workers, remux_workers, no_in_place_edit, report, probe_cache):
     input_folder = Path(input_folder)
     assert input_folder.exists(), "Input folder does not exist"
     extensions_whitelist = [ext.lstrip('.') for ext in extensions_whitelist]
     assert (language_audio_blacklist and not language_audio_whitelist) or (language_audio_whitelist and not language_audio_blacklist), "Only one between language blacklist and whitelist must be chosen for audio"
     assert not default_audio_lang or (language_audio_whitelist and default_audio_lang in language_audio_whitelist) or (language_audio_blacklist and default_audio_lang not in language_audio_blacklist), "You chose as default a language that you want to remove"
+    options = ProcessingOptions(
+        language_audio_blacklist=language_audio_blacklist,
+        language_audio_whitelist=language_audio_whitelist,
+        default_audio_lang=default_audio_lang,
+        default_sub_lang=default_sub_lang,
+        disable_sub_processing=disable_sub_processing,
+        sub_choice_selector=sub_choice_selector,
+        in_place_edit=not no_in_place_edit,
+    )
+
+    target_files = get_target_files(input_folder, extensions_whitelist, include_subdirs)
+    cache = ProbeCache(probe_cache) if probe_cache else None
+    processing_report = ProcessingReport()
+    try:
+        _process_files(target_files, options, dry_run, tmp_folder, auto_confirm, probe_workers, remux_workers, cache, processing_report)
+    finally:
+        if cache is not None:
+            cache.prune()
+            cache.close()
+        processing_report.print_summary()
+        if report:
+            processing_report.write(report)
+
 
+def _process_files(target_files, options, dry_run, tmp_folder, auto_confirm, probe_workers, remux_workers, cache=None, report=None):
+    files_len = len(target_files)
+    if report is None:
+        report = ProcessingReport()
+
+    # analysis stage: probe all files in parallel and build the full plan before touching anything
+    print(f"> Probing {files_len} files with {probe_workers} workers...")
+    start_time = time.perf_counter()
+    files_info = probe_files(target_files, workers=probe_workers, cache=cache, report=report)
+    files_needing_sizes = [f for f in target_files if files_info.get(f) is not None and needs_sub_sizes(files_info[f], options)]
+    subs_sizes = probe_sub_sizes(files_needing_sizes, files_info, workers=probe_workers, cache=cache, report=report)
+    print(f"> Probing completed in {time.perf_counter() - start_time:.2f} s\n")
+
+    plans = []
+    for index, target_file in enumerate(target_files, start=1):
+        file_stats = report.get(target_file)
+        file_stats.size = target_file.stat().st_size
+        print(f"[{index}/{files_len}]\n> Analyzing {target_file.name} [{human_readable(file_stats.size)}]")
+        file_info = files_info.get(target_file)
+        if file_info is None:
+            print(">> WARNING: unable to probe the file. Skipping.\n")
+            file_stats.error = "probe failed"
+            continue
+        start_time = time.perf_counter()
+        plan = build_plan(target_file, file_info, options, subs_sizes.get(target_file))
+        file_stats.plan = time.perf_counter() - start_time
+        if dry_run and plan.has_changes:
+            print("[DRY RUN] Would execute")
+            print(" ".join(get_plan_command(plan, options, tmp_folder)))
+        elif dry_run:
+            print("[DRY RUN] Would not process anything")
+        elif plan.has_changes:
+            print(">> Command to execute")
+            print(" ".join(get_plan_command(plan, options, tmp_folder)))
+            plans.append(plan)
+        print()
+
+    if not plans:
+        return
+
+    # remux stage
+    if not auto_confirm:
+        input(f"\n>>>\tPress Enter to process {len(plans)} files...")
+    print(f">>> PROCESSING with {remux_workers} workers...")
+    with ThreadPoolExecutor(max_workers=max(1, remux_workers)) as executor:
+        futures = {executor.submit(apply_plan, plan, options, tmp_folder): plan.target_file for plan in plans}
+        for index, future in enumerate(as_completed(futures), start=1):
+            target_file = futures[future]
+            file_stats = report.get(target_file)
+            try:
+                apply_stats = future.result()
+                for k, v in apply_stats.items():
+                    setattr(file_stats, k, v)
+                print(f"[{index}/{len(plans)}] Processed {target_file.name} in {file_stats.processing_time:.2f} s [{file_stats.throughput:.2f} MB/s]")
+                if cache is not None:
+                    cache.invalidate(target_file)
+            except Exception as e:
+                file_stats.error = str(e)
+                print(f"[{index}/{len(plans)}] ERROR processing {target_file.name}: {e}")
+
+
+@dataclass(frozen=True)
+class ProcessingOptions:
+    language_audio_blacklist: tuple
+    language_audio_whitelist: tuple
+    default_audio_lang: str | None
+    default_sub_lang: str | None
+    disable_sub_processing: bool
+    sub_choice_selector: str
+    in_place_edit: bool = True
+
+
+@dataclass
+class FilePlan:
+    """
+    Changes to apply to a file.
+        audio_ids_to_keep: ids of the audio tracks to keep, None to keep them all
+        flag_changes: list of (track, flag, value) with flag either "default" or "forced"
+    """
+    target_file: Path
+    audio_ids_to_keep: list[int] | None = None
+    flag_changes: list[tuple[Track, str, bool]] = field(default_factory=list)
+
+    @property
+    def effective_flag_changes(self):
+        # the flag changes that actually change the current value of the track
+        return [(tr, flag, value) for tr, flag, value in self.flag_changes
+                if value != (tr.default_track if flag == "default" else tr.forced_track)]
+
+    @property
+    def has_changes(self):
+        return self.audio_ids_to_keep is not None or len(self.effective_flag_changes) > 0
+
+    @property
+    def is_flag_only(self):
+        # only the headers must be edited, no need to rewrite the whole file
+        flag_changes = self.effective_flag_changes
+        return self.audio_ids_to_keep is None and len(flag_changes) > 0 and all(tr.uid is not None for tr, _, _ in flag_changes)
+
+    def mkvmerge_arguments(self):
+        arguments = []
+        if self.audio_ids_to_keep is not None:
+            arguments += ["-a", ",".join([str(i) for i in self.audio_ids_to_keep])]
+        for tr, flag, value in self.effective_flag_changes:
+            option = "--default-track-flag" if flag == "default" else "--forced-display-flag"
+            arguments += [option, str(tr.id) if value else f"{tr.id}:0"]
+        return arguments
+
+    def mkvpropedit_arguments(self):
+        # select tracks by uid, the ids of mkvmerge are not valid for mkvpropedit
+        arguments = []
+        for tr, flag, value in self.effective_flag_changes:
+            arguments += ["--edit", f"track:={tr.uid}", "--set", f"flag-{flag}={int(value)}"]
+        return arguments
+
+
+def get_target_files(input_folder, extensions_whitelist, include_subdirs):
     if include_subdirs:
         glob_prefix = "**/*"
     else:
         glob_prefix = "*"
-
+    target_files = []
     for ext in extensions_whitelist:
-        target_files = list(input_folder.glob(f"{glob_prefix}.{ext}"))
-        files_len = len(target_files)
-        for index, target_file in enumerate(target_files, start=1):
-            file_dir = target_file.parent
-            # todo: use a proper temp file
-            if not tmp_folder:
-                tmp_folder = file_dir
-            else:
-                tmp_folder = Path(tmp_folder)
-                tmp_folder.mkdir(parents=True, exist_ok=True)
-            tmp_file = tmp_folder / f"tmp_some_random_chars.{ext}"
-            print(f"[{index}/{files_len}]\n> Analyzing {target_file.name} [{human_readable(target_file.stat().st_size)}]")
-
-            # get audio languages
-            file_info = process_utils.execute_command(["mkvmerge", "-J", str(target_file)], return_output=True, silent=True)
-            file_info = json.loads(file_info)
-            audio_tracks = get_audio_tracks(file_info)
-            subtitles_tracks = get_subtitle_tracks(file_info)
-            audio_ids_to_keep = [str(tr['id']) for tr in get_tracks_to_keep_by_lang(tracks=audio_tracks, languages_blacklist=language_audio_blacklist, languages_whitelist=language_audio_whitelist, allow_none=True)]
-            has_languages_to_remove = len(audio_ids_to_keep) < len(audio_tracks)
-            
-            # create map uid -> id 
-            # the uid is used by e.g. mediainfo
-            # the id by mkvmerge
-            id_map = {}
-            def attach_id_map(tracks):
-                for tr in tracks:
-                    id = tr["id"]
-                    uid = tr.get("properties", {})["uid"]
-                    id_map[str(uid)] = id
-            attach_id_map(audio_tracks)
-            attach_id_map(subtitles_tracks)
-
-
-            audio_arguments = []
-            print(f">> Found {len(audio_tracks) - len(audio_ids_to_keep)}/{len(audio_tracks)} audio tracks to remove.")
-
-            if len(audio_tracks) > 1:
-                if has_languages_to_remove and len(audio_ids_to_keep) > 0:
-                    
-                    audio_ids_to_keep = ",".join(audio_ids_to_keep)
-                    audio_arguments += ["-a", audio_ids_to_keep]
-                elif has_languages_to_remove:
-                    print("WARNING: ALL LANGUAGES WOULD BE REMOVED. SKIPPING AUDIO REMOVAL.")
-                
-                if default_audio_lang:
-                    # set all audio tracks with target the default lang as default
-                    audio_tracks_to_default = [str(tr["id"]) for tr in audio_tracks if str(tr["id"]) in audio_ids_to_keep and (get_track_language(tr) == default_audio_lang or get_ietf_track_language(tr) == default_audio_lang)]
-                    for def_audio in audio_tracks_to_default:
-                        audio_arguments += ["--default-track-flag", def_audio]
+        target_files.extend(input_folder.glob(f"{glob_prefix}.{ext}"))
+    return target_files
+
+
+def probe_files(target_files, workers, cache=None, report=None):
+    """
+    Run mkvmerge -J on all the files in parallel.
+    Return a dict file -> MkvFile, with None for the files that could not be probed.
+    Files with a valid entry in the cache are not probed again.
+    """
+    files_info = {}
+    if cache is not None:
+        for target_file in target_files:
+            cached = cache.get(target_file, "mkvmerge")
+            if cached is not None:
+                files_info[target_file] = MkvFile.from_json(cached)
+                if report is not None:
+                    report.get(target_file).cached_probe = True
+    to_probe = [f for f in target_files if f not in files_info]
+    results = run_commands([["mkvmerge", "-J", str(f)] for f in to_probe], max_concurrency=workers)
+    for target_file, res in zip(to_probe, results):
+        if report is not None:
+            report.get(target_file).mkvmerge_probe = res.duration
+        if res.ok:
+            json_data = json.loads(res.stdout)
+            files_info[target_file] = MkvFile.from_json(json_data)
+            if cache is not None:
+                cache.set(target_file, "mkvmerge", json_data)
+        else:
+            print(f">> mkvmerge failed on {target_file}: {res.stderr.strip() or res.stdout.strip()}")
+            files_info[target_file] = None
+    return files_info
+
+
+def needs_sub_sizes(file_info, options):
+    # the subtitle sizes (from mediainfo) are necessary only to choose between multiple subs with the target language
+    if options.disable_sub_processing or not options.default_sub_lang:
+        return False
+    if len(file_info.subtitle_tracks) <= 1:
+        return False
+    return len(file_info.tracks_by_language("subtitles", options.default_sub_lang)) > 1
+
+
+def probe_sub_sizes(target_files, files_info, workers, cache=None, report=None):
+    """
+    Run mediainfo on all the files in parallel.
+    Return a dict file -> {track id: stream size} for the subtitles tracks.
+    Files with a valid entry in the cache are not probed again.
+    """
+    subs_sizes = {}
+    if cache is not None:
+        for target_file in target_files:
+            cached = cache.get(target_file, "mediainfo")
+            if cached is not None:
+                # json keys are always strings
+                subs_sizes[target_file] = {int(k): v for k, v in cached.items()}
+    to_probe = [f for f in target_files if f not in subs_sizes]
+    results = run_commands([["mediainfo", "--Output=JSON", str(f)] for f in to_probe], max_concurrency=workers)
+    for target_file, res in zip(to_probe, results):
+        if report is not None:
+            report.get(target_file).mediainfo_probe = res.duration
+        if not res.ok:
+            print(f">> mediainfo failed on {target_file}: {res.stderr.strip()}")
+            continue
+        # create map uid -> id
+        # the uid is used by e.g. mediainfo
+        # the id by mkvmerge
+        file_info = files_info[target_file]
+        id_map = {str(tr.uid): tr.id for tr in file_info.audio_tracks + file_info.subtitle_tracks}
+        mediainfo_data = json.loads(res.stdout)
+        tracks = mediainfo_data.get("media", {}).get("track",[])
+        subs_sizes[target_file] = {id_map[tr["UniqueID"]]: tr["StreamSize"] for tr in tracks if tr["@type"] == "Text"}
+        if cache is not None:
+            cache.set(target_file, "mediainfo", subs_sizes[target_file])
+    return subs_sizes
+
+
+def build_plan(target_file, file_info, options, subs_sizes=None):
+    """
+    Return the FilePlan with the changes to apply to the file.
+        subs_sizes: dict {track id: stream size} of the subtitles, used to choose between multiple subs with the same language
+    """
+    plan = FilePlan(target_file=target_file)
+    audio_tracks = file_info.audio_tracks
+    subtitles_tracks = file_info.subtitle_tracks
+    audio_ids_to_keep = [tr.id for tr in filter_tracks_by_lang(audio_tracks, languages_blacklist=options.language_audio_blacklist, languages_whitelist=options.language_audio_whitelist, allow_none=True)]
+    has_languages_to_remove = len(audio_ids_to_keep) < len(audio_tracks)
+
+    print(f">> Found {len(audio_tracks) - len(audio_ids_to_keep)}/{len(audio_tracks)} audio tracks to remove.")
+
+    if len(audio_tracks) > 1:
+        if has_languages_to_remove and len(audio_ids_to_keep) > 0:
+            plan.audio_ids_to_keep = audio_ids_to_keep
+        elif has_languages_to_remove:
+            print("WARNING: ALL LANGUAGES WOULD BE REMOVED. SKIPPING AUDIO REMOVAL.")
+
+        if options.default_audio_lang:
+            # set all audio tracks with target the default lang as default, if they are not already
+            for tr in audio_tracks:
+                if tr.id in audio_ids_to_keep and tr.has_language(options.default_audio_lang) and not tr.default_track:
+                    plan.flag_changes.append((tr, "default", True))
+    else:
+        print(">> Only one audio track, skipping audio processing.")
+
+    def is_better_sub(current_best_size, candidate_best_size):
+        return (
+            (options.sub_choice_selector == "max_size" and candidate_best_size > current_best_size) or
+            (options.sub_choice_selector == "min_size" and candidate_best_size < current_best_size)
+        )
+
+    # process subs
+    if not options.disable_sub_processing and len(subtitles_tracks) > 1:
+
+        if options.default_sub_lang:
+            target_subs = file_info.tracks_by_language("subtitles", options.default_sub_lang)
+            # get current default and forced, to disable them
+            default_subs = [tr for tr in subtitles_tracks if tr.default_track]
+            forced_subs = [tr for tr in subtitles_tracks if tr.forced_track]
+
+            sub_to_default = None
+
+            if len(target_subs) == 1:
+                print(">> Found sub with target language")
+                sub_to_default = target_subs[0]
+
+            elif len(target_subs) > 1:
+                print(">> Found multiple subs with target language")
+                subs_sizes = subs_sizes or {}
+                # pick the one with biggest size
+                sub_to_default = target_subs[0]
+                target_sub_size = -1
+                for s in target_subs:
+                    s_size = int(subs_sizes.get(s.id, -1))
+                    if is_better_sub(target_sub_size, s_size):
+                        sub_to_default = s
+                        target_sub_size = s_size
+
             else:
-                print(">> Only one audio track, skipping audio processing.")
-
-            def get_media_info_sub_data():
-                mediainfo_data = process_utils.execute_command(["mediainfo", "--Output=JSON", str(target_file)], return_output=True, silent=True)
-                mediainfo_data = json.loads(mediainfo_data)
-                tracks = mediainfo_data.get("media", {}).get("track",[])
-                sub_tracks = [(id_map[tr["UniqueID"]], tr["StreamSize"]) for tr in tracks if tr["@type"] == "Text"]
-                return sub_tracks
-
-            def is_better_sub(current_best_size, candidate_best_size):
-                return (
-                    (sub_choice_selector == "max_size" and candidate_best_size > current_best_size) or
-                    (sub_choice_selector == "min_size" and candidate_best_size < current_best_size)
-                )
-
-            # process subs
-            subs_arguments = []
-
-            if not disable_sub_processing and len(subtitles_tracks) > 1:
-                
-                if default_sub_lang:
-                    target_subs = get_tracks_to_keep_by_lang(tracks=subtitles_tracks, languages_whitelist=[default_sub_lang])
-                    # get current default and forced, to disable them
-                    default_subs = get_default_subs(subtitles_tracks)
-                    default_subs_ids = [subb[0] for subb in default_subs]
-                    forced_subs = get_forced_subs(subtitles_tracks)
-                    forced_subs_ids = [subb[0] for subb in forced_subs]
-                    
-                    sub_to_default = None
-
-                    if len(target_subs) == 1:
-                        print(">> Found sub with target language")
-                        sub_to_default = target_subs[0]["id"]
-                    
-                    elif len(target_subs) > 1:
-                        print(">> Found multiple subs with target language")
-                        subs_sizes = get_media_info_sub_data()
-                        subs_sizes = dict(subs_sizes)
-                        # pick the one with biggest size
-                        sub_to_default = target_subs[0]["id"]
-                        target_sub_size = -1
-                        for s in target_subs:
-                            s_size = int(subs_sizes.get(s["id"], -1))
-                            if is_better_sub(target_sub_size, s_size):
-                                sub_to_default = s["id"]
-                                target_sub_size = s_size
-                    
-                    else:
-                        print(f">> No sub found with target language [{default_sub_lang}]. Skipping sub processing.")
-                        available_langs = list(set([track.get("properties", {}).get("language", None) for track in subtitles_tracks]))
-                        print(f"Available languages are: {available_langs}")
-                    
-                    if sub_to_default:
-                        for s_id in default_subs_ids:
-                            if s_id != sub_to_default:
-                                subs_arguments += ["--default-track-flag", f"{s_id}:0"]
-                        if sub_to_default not in default_subs_ids:
-                            # add default track only if there are other subs and it's not already default
-                            subs_arguments += ["--default-track-flag", sub_to_default]
-                        else:
-                            print(">> New default sub = current default. Not adding new default track.")
-                    if forced_subs_ids:
-                        for s_id in forced_subs_ids:
-                            if s_id != sub_to_default:
-                                # remove old forced subs
-                                subs_arguments += ["--forced-display-flag", f"{s_id}:0"]
-            elif not disable_sub_processing:
-                print("Only one sub track. Skipping sub processing.")
-
-            append_arguments = audio_arguments + subs_arguments
-            append_arguments = [str(chunk) for chunk in append_arguments]
-
-            if dry_run and append_arguments:
-                print("[DRY RUN] Would execute")
-                print(f'{" ".join(["mkvmerge", "-o", str(tmp_file)] + append_arguments + [str(target_file)])}')
-            elif dry_run:
-                print("[DRY RUN] Would not process anything")
-            elif append_arguments:
-                print(">> Command to execute")
-                print(f'{" ".join(["mkvmerge", "-o", str(tmp_file)] + append_arguments + [str(target_file)])}')
-                if not auto_confirm:
-                    input("\n>>>\tPress Enter to continue...")
-                print(">>> PROCESSING...")
-                process_utils.execute_command(["mkvmerge", "-o", str(tmp_file)] + append_arguments + [target_file], silent=True)
-                target_file.unlink()
-                tmp_file.rename(target_file)
-            print()
-            
-                
-                
+                print(f">> No sub found with target language [{options.default_sub_lang}]. Skipping sub processing.")
+                available_langs = list(file_info.languages("subtitles"))
+                print(f"Available languages are: {available_langs}")
+
+            if sub_to_default is not None:
+                for s in default_subs:
+                    if s is not sub_to_default:
+                        plan.flag_changes.append((s, "default", False))
+                if sub_to_default not in default_subs:
+                    # add default track only if there are other subs and it's not already default
+                    plan.flag_changes.append((sub_to_default, "default", True))
+                else:
+                    print(">> New default sub = current default. Not adding new default track.")
+            for s in forced_subs:
+                if s is not sub_to_default:
+                    # remove old forced subs
+                    plan.flag_changes.append((s, "forced", False))
+    elif not options.disable_sub_processing:
+        print("Only one sub track. Skipping sub processing.")
+
+    return plan
+
+
+def get_tmp_folder(target_file, tmp_folder=None):
+    # by default use the folder of the file, so that the final replace is a simple rename on the same filesystem
+    if not tmp_folder:
+        return target_file.parent
+    return Path(tmp_folder)
+
+
+def get_tmp_prefix(target_file):
+    return f".tmp_{target_file.stem}_"
+
+
+def get_remux_command(target_file, tmp_file, append_arguments):
+    return ["mkvmerge", "-o", str(tmp_file)] + append_arguments + [str(target_file)]
+
+
+def get_plan_command(plan, options, tmp_folder=None):
+    if options.in_place_edit and plan.is_flag_only:
+        return ["mkvpropedit", str(plan.target_file)] + plan.mkvpropedit_arguments()
+    # the actual temp file is created only when the plan is applied
+    tmp_file = get_tmp_folder(plan.target_file, tmp_folder) / f"{get_tmp_prefix(plan.target_file)}XXXXXXXX{plan.target_file.suffix}"
+    return get_remux_command(plan.target_file, tmp_file, plan.mkvmerge_arguments())
+
+
+def apply_plan(plan, options, tmp_folder=None):
+    """
+    Apply the plan to its file and return a dict with the stats of the processing (fields of FileStats).
+    """
+    if options.in_place_edit and plan.is_flag_only:
+        # only flags to change: edit the headers in place rather than rewriting the whole file
+        start_time = time.perf_counter()
+        process_utils.execute_command(get_plan_command(plan, options), silent=True, shell=False)
+        return {"method": "mkvpropedit", "remux": time.perf_counter() - start_time}
+    return {"method": "mkvmerge"} | remux_file(plan.target_file, plan.mkvmerge_arguments(), tmp_folder)
+
+
+def remux_file(target_file, append_arguments, tmp_folder=None):
+    """
+    Remux the file with the given arguments and replace it.
+    Return a dict with remux and replace times and bytes read and written.
+    """
+    # unique temp file for each job, so that parallel jobs do not collide
+    tmp_file = make_temp_file(get_tmp_folder(target_file, tmp_folder), prefix=get_tmp_prefix(target_file), suffix=target_file.suffix)
+    try:
+        bytes_read = target_file.stat().st_size
+        start_time = time.perf_counter()
+        process_utils.execute_command(get_remux_command(target_file, tmp_file, append_arguments), silent=True, shell=False)
+        remux_time = time.perf_counter() - start_time
+        bytes_written = tmp_file.stat().st_size
+        if not is_same_filesystem(tmp_file, target_file.parent):
+            # the file is read and written again to move it
+            bytes_read += bytes_written
+            bytes_written *= 2
+        start_time = time.perf_counter()
+        # if the temp folder is on another filesystem the file is first streamed next to the target
+        atomic_replace(tmp_file, target_file)
+        replace_time = time.perf_counter() - start_time
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return {"remux": remux_time, "replace": replace_time, "bytes_read": bytes_read, "bytes_written": bytes_written}
 
 
 if __name__ == "__main__":